@@ -0,0 +1,147 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import sudo
+
+CORPORA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks")
+# Bundled corpora, from easiest to hardest
+CORPORA = ("easy", "intersection", "subsets", "fish", "unsolvable")
+
+def load_corpus(name):
+    """Load the puzzle strings of a bundled corpus, or of a bulk file if name is a path."""
+    path = name if os.path.isfile(name) else os.path.join(CORPORA_DIR, "{}.txt".format(name))
+    with open(path, "r") as f_in:
+        return [values for _, values in sudo.read_bulk_puzzles(f_in)]
+
+def percentile(values, p):
+    """Return the p-th percentile of a sorted list with the nearest-rank method."""
+    if not values:
+        return 0.0
+    rank = max(1, -(-len(values) * p // 100))
+    return values[int(rank) - 1]
+
+def run_corpus(puzzles, repeat=1, search=False):
+    """Solve a list of puzzle strings and return the benchmark results."""
+    latencies = []
+    solved = 0
+    for _ in range(repeat):
+        for values in puzzles:
+            start = time.perf_counter()
+            p = sudo.Puzzle(values)
+            if p.solve(search=search):
+                solved += 1
+            latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    total = sum(latencies)
+
+    # Measure memory in a separate pass, as tracing slows the solver down
+    tracemalloc.start()
+    for values in puzzles:
+        sudo.Puzzle(values).solve(search=search)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "puzzles": len(puzzles),
+        "puzzles_per_sec": len(latencies) / total if total else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "solve_rate": solved / len(latencies) if latencies else 0.0,
+        "peak_memory_kb": peak_memory / 1024,
+    }
+
+def run_generator(difficulty, count, seed=0):
+    """Generate puzzles of a difficulty level and return the benchmark results."""
+    generator = sudo.Generator(difficulty, seed=seed)
+    start = time.perf_counter()
+    for _ in range(count):
+        generator.generate()
+    elapsed = time.perf_counter() - start
+    return {
+        "puzzles": count,
+        "puzzles_per_sec": count / elapsed if elapsed else 0.0,
+        "attempts": generator.attempts,
+    }
+
+def compare(results, baseline, threshold):
+    """Return a list of messages for the corpora which are slower than the baseline by more than threshold."""
+    regressions = []
+    for name, r in results["corpora"].items():
+        b = baseline.get("corpora", {}).get(name)
+        if not b or not b["puzzles_per_sec"]:
+            continue
+        slowdown = 1 - r["puzzles_per_sec"] / b["puzzles_per_sec"]
+        if slowdown > threshold:
+            regressions.append("{}: {:.1f} puzzles/sec, {:.1%} slower than baseline ({:.1f} puzzles/sec)".format(
+                name, r["puzzles_per_sec"], slowdown, b["puzzles_per_sec"]))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the sudoku solver over graded puzzle corpora")
+    parser.add_argument("corpora", metavar="CORPUS", nargs="*", default=list(CORPORA),
+            help="Names of bundled corpora ({}) or paths to bulk files [Default: all bundled corpora]".format(
+                ", ".join(CORPORA)))
+    parser.add_argument("-r", "--repeat", type=int, default=1,
+            help="Solve each corpus this many times [Default: 1]")
+    parser.add_argument("--search", action="store_true",
+            help="Complete puzzles with a search when logic cannot make further progress [Default: False]")
+    parser.add_argument("--generate", type=int, default=0, metavar="N",
+            help="Also generate N puzzles of each difficulty level ({}) [Default: 0]".format(
+                ", ".join(sudo.DIFFICULTIES)))
+    parser.add_argument("-o", "--output", type=str, metavar="FILE",
+            help="Write the results to FILE as JSON [Default: None]")
+    parser.add_argument("--baseline", type=str, metavar="FILE",
+            help="Compare the results to a JSON file written by a previous run [Default: None]")
+    parser.add_argument("--threshold", type=float, default=0.1,
+            help="Fail if a corpus is slower than the baseline by more than this fraction [Default: 0.1]")
+
+    args = parser.parse_args()
+
+    # Unsolvable puzzles are expected, do not report them
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.CRITICAL)
+
+    results = {
+        "python": platform.python_version(),
+        "repeat": args.repeat,
+        "search": args.search,
+        "corpora": {},
+        "generator": {},
+    }
+    print("{:<14} {:>8} {:>12} {:>9} {:>9} {:>7} {:>11}".format(
+        "Corpus", "Puzzles", "Puzzles/sec", "p50 ms", "p99 ms", "Solved", "Peak KiB"))
+    for name in args.corpora:
+        r = run_corpus(load_corpus(name), args.repeat, args.search)
+        results["corpora"][name] = r
+        print("{:<14} {:>8} {:>12.1f} {:>9.3f} {:>9.3f} {:>6.1%} {:>11.1f}".format(
+            name, r["puzzles"], r["puzzles_per_sec"], r["p50_ms"], r["p99_ms"], r["solve_rate"], r["peak_memory_kb"]))
+
+    if args.generate:
+        print("\n{:<14} {:>8} {:>12} {:>9}".format("Difficulty", "Puzzles", "Puzzles/sec", "Attempts"))
+        for difficulty in sudo.DIFFICULTIES:
+            r = run_generator(difficulty, args.generate)
+            results["generator"][difficulty] = r
+            print("{:<14} {:>8} {:>12.2f} {:>9}".format(difficulty, r["puzzles"], r["puzzles_per_sec"],
+                r["attempts"]))
+
+    if args.output:
+        with open(args.output, "w") as f_out:
+            json.dump(results, f_out, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f_in:
+            baseline = json.load(f_in)
+        regressions = compare(results, baseline, args.threshold)
+        for r in regressions:
+            logging.critical(r)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
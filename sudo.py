@@ -1,40 +1,200 @@
 import argparse
+import array
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import csv
+import functools
+import itertools
+import json
 import logging
+import mmap
+import multiprocessing
+import os
+import random
+import signal
+import sqlite3
+import struct
+import sys
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 DEBUG = False
 
+# Number of puzzles sent to a worker process at once in bulk mode
+BULK_CHUNK_SIZE = 64
+# Number of puzzles sent to a worker process at once by the batch solver
+BATCH_CHUNK_SIZE = 1024
+# Number of puzzles generated by a worker process at once
+GENERATE_CHUNK_SIZE = 16
+# Number of requests queued by the server, and of responses waiting to be written to each connection
+SERVE_QUEUE_SIZE = 1024
+# Number of records of a PuzzleFile validated and decoded at once, and the bytes allowed in its records
+PUZZLE_FILE_BLOCK = 4096
+PUZZLE_FILE_BYTES = b"0123456789.\r\n"
+# Header of packed puzzle files: magic, version, flags, record size and number of records
+PACKED_HEADER = struct.Struct("<4sBBHI")
+PACKED_MAGIC = b"SDKP"
+PACKED_VERSION = 1
+# Header flag of packed files with solutions, and status flags of packed solutions
+PACKED_SOLUTIONS = 1
+PACKED_SOLVED = 1
+PACKED_SEARCHED = 2
+# Number of results written to a ResultStore in one transaction
+STORE_BATCH_SIZE = 1024
+
+# Candidates are stored as 9-bit masks: bit (d - 1) is set if digit d is a candidate.
+ALL_CANDIDATES = 0x1FF
+# Number of set bits in each mask
+POPCOUNT = tuple(bin(m).count("1") for m in range(1 << 9))
+# Index of the lowest set bit in each mask (-1 for the empty mask)
+LOWEST_BIT = tuple((m & -m).bit_length() - 1 for m in range(1 << 9))
+# Indices of the set bits in each mask, in ascending order
+MASK_BITS = tuple(tuple(b for b in range(9) if m >> b & 1) for m in range(1 << 9))
+# Digits represented by each mask, in ascending order
+MASK_DIGITS = tuple(tuple(b + 1 for b in bits) for bits in MASK_BITS)
+
+# Static index tables shared by all grids
+ROW_INDICES = tuple(tuple(r * 9 + c for c in range(9)) for r in range(9))
+COLUMN_INDICES = tuple(tuple(r * 9 + c for r in range(9)) for c in range(9))
+BOX_INDICES = tuple(tuple((((b // 3) * 3) + (i // 3)) * 9 + ((b % 3) * 3) + (i % 3) for i in range(9)) for b in range(9))
+UNIT_INDICES = ROW_INDICES + COLUMN_INDICES + BOX_INDICES
+# Index of the first unit of each kind in UNIT_INDICES
+UNIT_OFFSETS = {"Row": 0, "Column": 9, "Box": 18}
+# Units containing each square
+SQUARE_UNITS = tuple(tuple(u for u, squares in enumerate(UNIT_INDICES) if i in squares) for i in range(81))
+# Squares sharing a unit with each square
+PEER_INDICES = tuple(tuple(sorted({j for u in SQUARE_UNITS[i] for j in UNIT_INDICES[u]} - {i})) for i in range(81))
+# Row, column and box of each square, with the bits of the square in the digit positions of each of them (see
+# Grid.row_positions): (row, column, box, column bit, row bit, bit of the position in the box)
+SQUARE_POSITIONS = tuple((i // 9, i % 9, i // 27 * 3 + i % 9 // 3, 1 << (i % 9), 1 << (i // 9),
+    1 << (i // 9 % 3 * 3 + i % 3)) for i in range(81))
+
+# The move stack holds one packed integer per move: (cleared << 18) | (square index << 11) | (operation << 9) | digit
+# mask, where cleared is the mask of the candidates taken away by an assignment or a MOVE_CANDIDATES move, so that
+# every move can be undone, see Grid.rollback()
+MOVE_ASSIGN = 0
+MOVE_REMOVE = 1
+MOVE_CANDIDATES = 2
+MOVE_TYPECODE = "L"
+
+def format_move(move):
+    """Format a packed move as text, e.g. "12=5" for an assignment or "12-=39" for removed candidates."""
+    index, op, mask = move >> 11 & 0x7F, move >> 9 & 3, move & ALL_CANDIDATES
+    return "{}{}={}".format(index, "-" if op == MOVE_REMOVE else "", mask_str(mask))
+
+def count_eliminations(moves, start=0):
+    """Count the candidates removed by the packed moves from index start onwards."""
+    return sum([POPCOUNT[m & ALL_CANDIDATES] for m in moves[start:] if m >> 9 & 3 == MOVE_REMOVE])
+
+# Names of the N-sets found by the subset techniques
+SUBSET_NAMES = ("", "single", "pair", "triple", "quadruple", "quintuple", "sextuple", "septuple", "octuple")
+# Default size of the largest naked/hidden subsets to look for
+MAX_SUBSET = 4
+
+def find_subsets(masks, n):
+    """Yield (union, members) for each combination of n masks whose union has exactly n bits, where members is the
+    bitmask of the indices of the combined masks. Combinations are enumerated in lexicographic order, and partial
+    combinations whose union already has more than n bits are pruned."""
+    def extend(start, depth, union, members):
+        # Leave enough masks to complete the combination
+        for k in range(start, len(masks) - (n - depth) + 1):
+            u = union | masks[k]
+            if POPCOUNT[u] > n:
+                continue
+            if depth + 1 == n:
+                if POPCOUNT[u] == n:
+                    yield u, members | 1 << k
+            else:
+                yield from extend(k + 1, depth + 1, u, members | 1 << k)
+    return extend(0, 0, 0, 0)
+
+# Names of the N-fishes found by the fish techniques
+FISH_NAMES = ("", "", "an X-Wing", "a Swordfish", "a Jellyfish")
+
+def join_numbers(numbers):
+    """Join numbers for a message, e.g. [1, 2, 3] -> "1, 2 and 3"."""
+    numbers = [str(x) for x in numbers]
+    return ", ".join(numbers[:-1]) + " and " + numbers[-1] if len(numbers) > 1 else "".join(numbers)
+
+# Largest number of orders of lines with equal keys compared while computing a canonical form
+CANONICAL_STATES = 5000
+# Number of refinements of the keys of the squares while computing a canonical form
+CANONICAL_ROUNDS = 3
+
+def digit_mask(values):
+    """Convert an iterable of digits to a candidate mask."""
+    mask = 0
+    for v in values:
+        mask |= 1 << (v - 1)
+    return mask
+
+def mask_str(mask):
+    """Format the digits in a candidate mask as a string, e.g. 0b101 -> "13"."""
+    return "".join([str(x) for x in MASK_DIGITS[mask]])
+
+# A successful technique: units is a tuple of (unit name, index) pairs, digits is the mask of the digits involved,
+# size is the number of squares or lines of the pattern and eliminations is a tuple of (square index, removed mask)
+Deduction = collections.namedtuple("Deduction", ("technique", "units", "digits", "size", "eliminations"))
+
+def format_deduction(event):
+    """Format a Deduction as a sentence, e.g. "Found a 37 naked pair in Row 4"."""
+    technique, units, digits, size = event.technique, event.units, event.digits, event.size
+    if technique in ("Naked subset", "Hidden single", "Hidden subset"):
+        return "Found a {} {} {} in {} {}".format(mask_str(digits), technique.split()[0].lower(), SUBSET_NAMES[size],
+            units[0][0], units[0][1] + 1)
+    if technique in ("Naked line", "Hidden line"):
+        return "Found a {} on {}s in {} {}, {} {}".format(technique.lower(), mask_str(digits),
+            units[0][0], units[0][1] + 1, units[1][0], units[1][1] + 1)
+    if technique == "Fish":
+        name = FISH_NAMES[size]
+    else:
+        name = "a {} {}".format(technique.split()[0].lower(), FISH_NAMES[size].split(" ", 1)[1])
+    return "Found {} on {}s in {}s {}".format(name, mask_str(digits), units[0][0],
+        join_numbers([index + 1 for _, index in units]))
+
+def log_deduction(event):
+    """Log a Deduction, the observer behind the -v output."""
+    logging.info(format_deduction(event))
+
+class Contradiction(ValueError):
+    """Raised as soon as a grid can no longer be solved: a duplicate value, a square without candidates or a digit
+    without a place in a unit"""
+    pass
+
+class Interrupted(Exception):
+    """Raised when Puzzle.solve() runs out of time or iterations, or is cancelled. status is SOLVE_TIMED_OUT or
+    SOLVE_CANCELLED."""
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
 class Square:
-    """A Sudoku square"""
+    """A Sudoku square: a view of one entry of the value and candidate arrays of its grid"""
+
+    __slots__ = ("_grid", "_index", "_row", "_column", "_box", "_values", "_masks")
 
     digits = range(1,10)
 
-    def __init__(self, grid, index, row, column, box, value):
+    def __init__(self, grid, index, row, column, box):
         self._grid = grid
         self._index = index
         self._row = row
         self._column = column
         self._box = box
-
-        grid.squares.append(self)
-        row.squares.append(self)
-        column.squares.append(self)
-        box.squares.append(self)
-
-        if value:
-            self._value = value
-            self._candidates = set()
-            self._given = True
-        else:
-            self._value = None
-            self._candidates = set(Square.digits)
-            grid.unsolved_squares.append(self)
-            row.unsolved_squares.append(self)
-            column.unsolved_squares.append(self)
-            box.unsolved_squares.append(self)
-            self._given = False
+        # The arrays of the grid, for faster access
+        self._values = grid.values
+        self._masks = grid.masks
 
     def __str__(self):
-        return str(self._value) if self._value is not None else " ".join([str(x) for x in self._candidates])
+        value = self._values[self._index]
+        return str(value) if value else " ".join([str(x) for x in MASK_DIGITS[self._masks[self._index]]])
 
     @property
     def grid(self):
@@ -58,70 +218,169 @@ class Square:
 
     @property
     def given(self):
-        return self._given
+        return bool(self._grid.givens[self._index])
 
     @property
     def value(self):
-        return self._value
+        return self._values[self._index] or None
 
     @value.setter
     def value(self, value):
         if value in Square.digits:
-            self._value = value
-            self.grid.move_stack.append("{}={}".format(self.index, value))
-
-            self.row.unsolved_squares.remove(self)
-            self.column.unsolved_squares.remove(self)
-            self.box.unsolved_squares.remove(self)
+            i = self._index
+            bit = 1 << (value - 1)
+            for u in (self._row, self._column, self._box):
+                if u.placed & bit:
+                    self._grid.contradict("Duplicate {} in {} {}".format(value, u.unit, u.index + 1))
+            self._row.placed |= bit
+            self._column.placed |= bit
+            self._box.placed |= bit
+            masks = self._masks
+            cleared = masks[i]
+            self._values[i] = value
+            masks[i] = 0
+            self._grid.move_stack.append(cleared << 18 | i << 11 | MOVE_ASSIGN << 9 | bit)
+
+            self._grid.unsolved_squares.remove(self)
+            self._row.unsolved_squares.remove(self)
+            self._column.unsolved_squares.remove(self)
+            self._box.unsolved_squares.remove(self)
+
+            # The units of the square and the digits which were candidates have changed
+            self._row.generation += 1
+            self._column.generation += 1
+            self._box.generation += 1
+            self._clear_positions(cleared)
+
+            # Remove the value from the candidates of all peers
+            squares = self._grid.squares
+            for j in PEER_INDICES[i]:
+                if masks[j] & bit:
+                    squares[j].remove_mask(bit)
         else:
             raise ValueError("Invalid square value {}".format(value))
 
+    @property
+    def mask(self):
+        """The candidate bitmask of the square."""
+        return self._masks[self._index]
+
     @property
     def candidates(self):
-        return self._candidates
+        """A set view of the candidates, kept for compatibility. Modifying it does not affect the square."""
+        return set(MASK_DIGITS[self._masks[self._index]])
 
     @candidates.setter
     def candidates(self, values):
         v = set(values)
+        i = self._index
         # All values must be valid digits, and the set of values must be a subset of the set of candidates
-        if all([x in Square.digits for x in v]) and self._candidates >= v:
-            self._candidates = v
-            self.grid.move_stack.append("{}={}".format(self.index, "".join([str(x) for x in v])))
+        if all([x in Square.digits for x in v]) and not digit_mask(v) & ~self._masks[i]:
+            removed = self._masks[i] & ~digit_mask(v)
+            self._masks[i] = digit_mask(v)
+            self._grid.move_stack.append(removed << 18 | i << 11 | MOVE_CANDIDATES << 9 | self._masks[i])
+            self._notify_removed(removed)
         else:
             raise ValueError("Invalid square candidates {}".format("".join([str(x) for x in v])))
 
     def keep_candidates(self, values):
         v = set(values)
-        # Remove all candidates not in the provided set
-        if all([x in Square.digits for x in v]) and (self._candidates & v):
-            if self._candidates <= v:
+        if not all([x in Square.digits for x in v]):
+            raise ValueError("Invalid square candidates {}".format("".join([str(x) for x in v])))
+        return self.keep_mask(digit_mask(v))
+
+    def keep_mask(self, mask):
+        # Remove all candidates not in the provided mask
+        i = self._index
+        if self._masks[i] & mask:
+            removed = self._masks[i] & ~mask
+            if not removed:
                 # No change
                 return False
             else:
-                self._candidates = self._candidates & v
-                self.grid.move_stack.append("{}-={}".format(self.index, "".join([str(x) for x in set(self._candidates - v)])))
+                self._masks[i] &= mask
+                self._grid.move_stack.append(i << 11 | MOVE_REMOVE << 9 | removed)
+                self._notify_removed(removed)
                 return True
         else:
-            raise ValueError("Invalid square candidates {}".format("".join([str(x) for x in v])))
+            raise ValueError("Invalid square candidates {}".format(mask_str(mask)))
 
     def remove_candidate(self, value):
-        if value in self._candidates:
-            self._candidates.discard(value)
-            self.grid.move_stack.append("{}-={}".format(self.index, value))
+        return self.remove_mask(1 << (value - 1))
+
+    def remove_mask(self, mask):
+        i = self._index
+        removed = self._masks[i] & mask
+        if removed:
+            self._masks[i] ^= removed
+            self._grid.move_stack.append(i << 11 | MOVE_REMOVE << 9 | removed)
+            self._notify_removed(removed)
             return True
         else:
             return False
 
+    def _notify_removed(self, removed):
+        """Queue the singles that the removal of the candidates in the mask may have created, and mark the units
+        and digits of the square as changed."""
+        if removed:
+            mask = self._masks[self._index]
+            # A square left with a single candidate is a naked single
+            if POPCOUNT[mask] == 1:
+                self._grid.singles.append(self)
+            # A removed digit may be left with a single position in any of the units of the square
+            for u in (self._row, self._column, self._box):
+                if not u.pending:
+                    self._grid.pending_units.append(u)
+                u.pending |= removed
+                u.generation += 1
+            self._clear_positions(removed)
+            if not mask and not self._values[self._index]:
+                self._grid.contradict("No candidates left in square {}".format(self._index))
+
+    def _clear_positions(self, removed):
+        """Remove the square from the positions of the digits in the mask, and mark the digits as changed.
+
+        Raises Contradiction if a digit is left without a place in a unit where it has not been placed.
+        """
+        grid = self._grid
+        r, c, b, column_bit, row_bit, box_bit = SQUARE_POSITIONS[self._index]
+        lost = 0
+        for i in MASK_DIGITS[removed]:
+            grid.digit_generations[i] += 1
+            grid.row_positions[i][r] &= ~column_bit
+            grid.column_positions[i][c] &= ~row_bit
+            grid.box_positions[i][b] &= ~box_bit
+            if not (grid.row_positions[i][r] and grid.column_positions[i][c] and grid.box_positions[i][b]):
+                lost |= 1 << (i - 1)
+        if lost:
+            for u, positions in ((self._row, grid.row_positions), (self._column, grid.column_positions),
+                    (self._box, grid.box_positions)):
+                for i in MASK_DIGITS[lost & ~u.placed]:
+                    if not positions[i][u.index]:
+                        grid.contradict("No place left for {} in {} {}".format(i, u.unit, u.index + 1))
+
 class Unit:
-    """A grid unit (row, column, box)"""
+    """A grid unit (row, column, box): a view of nine squares of its grid, with the solving state of the unit"""
+
+    __slots__ = ("_grid", "_unit", "_index", "_indices", "_unsolved_squares", "pending", "placed", "generation",
+        "clean")
 
-    def __init__(self, grid, unit, index, size=9, squares=None):
+    def __init__(self, grid, unit, index):
         self._grid = grid
         self._unit = unit
         self._index = index
-        self._size = size
-        self._squares = squares if squares else list()
-        self._unsolved_squares = [x for x in squares if not x.value] if squares else list()
+        # Indices of the squares of the unit in the static tables
+        self._indices = UNIT_INDICES[UNIT_OFFSETS[unit] + index]
+        # Set up by the grid once its squares exist
+        self._unsolved_squares = []
+        # Mask of the digits removed from the unit since it was last checked for hidden singles
+        self.pending = 0
+        # Mask of the digits placed in the unit
+        self.placed = 0
+        # Incremented whenever the candidates or the unsolved squares of the unit change
+        self.generation = 0
+        # Technique -> generation of the unit when the technique last found nothing in it
+        self.clean = {}
 
     @property
     def grid(self):
@@ -137,185 +396,110 @@ class Unit:
 
     @property
     def size(self):
-        return self._size
+        return len(self._indices)
 
     @property
     def squares(self):
-        return self._squares
+        squares = self._grid.squares
+        return [squares[i] for i in self._indices]
 
     @property
     def unsolved_squares(self):
         return self._unsolved_squares
 
-    def find_naked_pairs(self):
-        """Find naked pairs in a unit. This method must only be called if the unit contains no unsolved singles."""
+    def find_naked_subsets(self, n):
+        """Find naked subsets of n squares in a unit. This method must only be called if the unit contains no unsolved singles."""
         # If we combine N cells, and the size of the union of their candidate sets is N, we have a naked N-set.
+        self._grid.check_deadline()
         affected_grid = False
-        for i in range(len(self.unsolved_squares)):
-            for j in range(i + 1, len(self.unsolved_squares)):
-                union = self.unsolved_squares[i].candidates | self.unsolved_squares[j].candidates
-                if len(union) == 2:
-                    # We have found a naked pair: remove values from candidates of all other squares in the unit
-                    for z, s in enumerate(self.unsolved_squares):
-                        if z not in (i, j):
-                            for c in union:
-                                affected_grid |= s.remove_candidate(c)
-                    if affected_grid:
-                        logging.info("Found a {values} naked pair in {unit} {index}".format(unit=self.unit,
-                            index=self.index + 1,
-                            values="".join([str(x) for x in sorted(union)])))
-                        return True
+        start = len(self.grid.move_stack)
+        # Only squares with at most N candidates can be part of a naked N-set
+        squares = [s for s in self.unsolved_squares if POPCOUNT[s.mask] <= n]
+        if len(self.unsolved_squares) <= n:
+            # A naked N-set covering all the unsolved squares cannot remove anything
+            return False
+        for union, members in find_subsets([s.mask for s in squares], n):
+            # We have found a naked N-set: remove values from candidates of all other squares in the unit
+            members = [squares[k] for k in MASK_BITS[members]]
+            for s in self.unsolved_squares:
+                if s not in members:
+                    affected_grid |= s.remove_mask(union)
+            if affected_grid:
+                if self.grid.observers:
+                    self.grid.notify("Naked subset", ((self.unit, self.index),), union, n, start)
+                return True
         return False
 
+    def find_naked_pairs(self):
+        """Find naked pairs in a unit. This method must only be called if the unit contains no unsolved singles."""
+        return self.find_naked_subsets(2)
+
     def find_naked_triples(self):
         """Find naked triples in a unit. This method must only be called if the unit contains no unsolved singles or pairs."""
-        # If we combine N cells, and the size of the union of their candidate sets is N, we have a naked N-set.
-        affected_grid = False
-        for i in range(len(self.unsolved_squares)):
-            for j in range(i + 1, len(self.unsolved_squares)):
-                for k in range(j + 1, len(self.unsolved_squares)):
-                    union = self.unsolved_squares[i].candidates | self.unsolved_squares[j].candidates | self.unsolved_squares[k].candidates
-                    if len(union) == 3:
-                        # We have found a naked triple: remove values from candidates of all other squares in the unit
-                        for z, s in enumerate(self.unsolved_squares):
-                            if z not in (i, j, k):
-                                for c in union:
-                                    affected_grid |= s.remove_candidate(c)
-                        if affected_grid:
-                            logging.info("Found a {values} naked triple in {unit} {index}".format(unit=self.unit,
-                                index=self.index + 1,
-                                values="".join([str(x) for x in sorted(union)])))
-                            return True
-        return False
+        return self.find_naked_subsets(3)
 
     def find_naked_quadruples(self):
         """Find naked quadruples in a unit. This method must only be called if the unit contains no unsolved singles, pairs or triples."""
-        # If we combine N cells, and the size of the union of their candidate sets is N, we have a naked N-set.
-        affected_grid = False
-        for i in range(len(self.unsolved_squares)):
-            for j in range(i + 1, len(self.unsolved_squares)):
-                for k in range(j + 1, len(self.unsolved_squares)):
-                    for l in range(k + 1, len(self.unsolved_squares)):
-                        union = self.unsolved_squares[i].candidates | self.unsolved_squares[j].candidates | self.unsolved_squares[k].candidates | self.unsolved_squares[l].candidates
-                        if len(union) == 4:
-                            # We have found a naked quadruple: remove values from candidates of all other squares in the unit
-                            for z, s in enumerate(self.unsolved_squares):
-                                if z not in (i, j, k, l):
-                                    for c in union:
-                                        affected_grid |= s.remove_candidate(c)
-                            if affected_grid:
-                                logging.info("Found a {values} naked quadruple in {unit} {index}".format(
-                                    unit=self.unit,
-                                    index=self.index + 1,
-                                    values="".join([str(x) for x in sorted(union)])))
-                                return True
-        return False
+        return self.find_naked_subsets(4)
+
+    def digit_positions(self):
+        """Return a list indexed by digit of the bitmasks of the positions of that digit in the unsolved squares."""
+        positions = [0] * 10
+        for p, s in enumerate(self.unsolved_squares):
+            for i in MASK_DIGITS[s.mask]:
+                positions[i] |= 1 << p
+        return positions
 
     def find_hidden_singles(self):
         """Find hidden singles in a unit and convert them to naked singles."""
         # If we find N numbers which, combined, occupy only N squares in a unit, we have a hidden N-set.
         affected_grid = False
-        positions = {i: set() for i in Square.digits}
+        start = len(self.grid.move_stack)
         # Save the sets of positions for each unsolved number in the unit
-        for p, s in enumerate(self.unsolved_squares):
-            for i in s.candidates:
-                positions[i].add(p)
-        # Detect overlapping sets
-        unsolved_numbers = set([i for i in positions.keys() if positions[i]])
-        for i in sorted(unsolved_numbers):
-            if len(positions[i]) == 1:
+        positions = self.digit_positions()
+        for i in Square.digits:
+            if POPCOUNT[positions[i]] == 1:
                 # We have found a hidden single: remove all other candidates from the squares which contain it
-                for p in positions[i]:
-                    affected_grid |= self.unsolved_squares[p].keep_candidates({i})
+                for p in MASK_BITS[positions[i]]:
+                    affected_grid |= self.unsolved_squares[p].keep_mask(1 << (i - 1))
                 if affected_grid:
-                    logging.info("Found a {values} hidden single in {unit} {index}".format(
-                        unit=self.unit,
-                        index=self.index + 1,
-                        values="".join([str(x) for x in sorted({i})])))
+                    if self.grid.observers:
+                        self.grid.notify("Hidden single", ((self.unit, self.index),), 1 << (i - 1), 1, start)
                     return True
         return False
 
-
-    def find_hidden_pairs(self):
-        """Find hidden pairs in a unit. This method must only be called if the unit contains no unsolved singles."""
+    def find_hidden_subsets(self, n):
+        """Find hidden subsets of n digits in a unit. This method must only be called if the unit contains no unsolved singles."""
         # If we find N numbers which, combined, occupy only N squares in a unit, we have a hidden N-set.
+        self._grid.check_deadline()
         affected_grid = False
-        positions = {i: set() for i in Square.digits}
+        start = len(self.grid.move_stack)
         # Save the sets of positions for each unsolved number in the unit
-        for p, s in enumerate(self.unsolved_squares):
-            for i in s.candidates:
-                positions[i].add(p)
-        # Detect overlapping sets
-        unsolved_numbers = set([i for i in positions.keys() if positions[i]])
-        for i in sorted(unsolved_numbers):
-            for j in [x for x in sorted(unsolved_numbers) if x > i]:
-                union = positions[i] | positions[j]
-                if len(union) == 2:
-                    # We have found a hidden pair: remove all other candidates from the squares which contain it
-                    for p in union:
-                        affected_grid |= self.unsolved_squares[p].keep_candidates({i, j})
-                    if affected_grid:
-                        logging.info("Found a {values} hidden pair in {unit} {index}".format(
-                            unit=self.unit,
-                            index=self.index + 1,
-                            values="".join([str(x) for x in sorted({i, j})])))
-                        return True
+        positions = self.digit_positions()
+        # Only numbers with at most N positions can be part of a hidden N-set
+        numbers = [i for i in Square.digits if 0 < POPCOUNT[positions[i]] <= n]
+        for union, members in find_subsets([positions[i] for i in numbers], n):
+            # We have found a hidden N-set: remove all other candidates from the squares which contain it
+            values = digit_mask([numbers[k] for k in MASK_BITS[members]])
+            for p in MASK_BITS[union]:
+                affected_grid |= self.unsolved_squares[p].keep_mask(values)
+            if affected_grid:
+                if self.grid.observers:
+                    self.grid.notify("Hidden subset", ((self.unit, self.index),), values, n, start)
+                return True
         return False
 
+    def find_hidden_pairs(self):
+        """Find hidden pairs in a unit. This method must only be called if the unit contains no unsolved singles."""
+        return self.find_hidden_subsets(2)
+
     def find_hidden_triples(self):
         """Find hidden triples in a unit. This method must only be called if the unit contains no unsolved singles."""
-        # If we find N numbers which, combined, occupy only N squares in a unit, we have a hidden N-set.
-        affected_grid = False
-        positions = {i: set() for i in Square.digits}
-        # Save the sets of positions for each unsolved number in the unit
-        for p, s in enumerate(self.unsolved_squares):
-            for i in s.candidates:
-                positions[i].add(p)
-        # Detect overlapping sets
-        unsolved_numbers = set([i for i in positions.keys() if positions[i]])
-        for i in sorted(unsolved_numbers):
-            for j in [x for x in sorted(unsolved_numbers) if x > i]:
-                for k in [x for x in sorted(unsolved_numbers) if x > j]:
-                    union = positions[i] | positions[j] | positions[k]
-                    if len(union) == 3:
-                        # We have found a hidden triple: remove all other candidates from the squares which contain it
-                        for p in union:
-                            affected_grid |= self.unsolved_squares[p].keep_candidates({i, j, k})
-                        if affected_grid:
-                            logging.info("Found a {values} hidden triple in {unit} {index}".format(
-                                unit=self.unit,
-                                index=self.index + 1,
-                                values="".join([str(x) for x in sorted({i, j, k})])))
-                            return True
-        return False
+        return self.find_hidden_subsets(3)
 
     def find_hidden_quadruples(self):
         """Find hidden quadruples in a unit. This method must only be called if the unit contains no unsolved singles."""
-        # If we find N numbers which, combined, occupy only N squares in a unit, we have a hidden N-set.
-        affected_grid = False
-        positions = {i: set() for i in Square.digits}
-        # Save the sets of positions for each unsolved number in the unit
-        for p, s in enumerate(self.unsolved_squares):
-            for i in s.candidates:
-                positions[i].add(p)
-        # Detect overlapping sets
-        unsolved_numbers = set([i for i in positions.keys() if positions[i]])
-        for i in sorted(unsolved_numbers):
-            for j in [x for x in sorted(unsolved_numbers) if x > i]:
-                for k in [x for x in sorted(unsolved_numbers) if x > j]:
-                    for l in [x for x in sorted(unsolved_numbers) if x > k]:
-                        union = positions[i] | positions[j] | positions[k] | positions[l]
-                        if len(union) == 4:
-                            # We have found a hidden quadruple: remove all other candidates from the squares which contain it
-                            for p in union:
-                                affected_grid |= self.unsolved_squares[p].keep_candidates({i, j, k, l})
-                            if affected_grid:
-                                logging.info("Found a {values} hidden quadruple in {unit} {index}".format(
-                                    unit=self.unit,
-                                    index=self.index + 1,
-                                    values="".join([str(x) for x in sorted({i, j, k, l})])))
-                                return True
-        return False
+        return self.find_hidden_subsets(4)
 
     def find_naked_lines(self):
         """Find naked lines (pointing singles/pairs/triples) in a box."""
@@ -326,48 +510,31 @@ class Unit:
         if self.unit != "Box":
             return False
 
-        candidate_squares = {i: set() for i in Square.digits}
-        # Find the candidate squares for each unsolved number in the box
+        candidate_rows = [0] * 10
+        candidate_columns = [0] * 10
+        # Find the candidate rows and columns for each unsolved number in the box
         for s in self.unsolved_squares:
-            for i in s.candidates:
-                candidate_squares[i].add(s)
-        for i, c in candidate_squares.items():
+            for i in MASK_DIGITS[s.mask]:
+                candidate_rows[i] |= 1 << s.row.index
+                candidate_columns[i] |= 1 << s.column.index
+        for i in Square.digits:
             # If we have at least one candidate square for i in the box
-            if c:
-                # Check for naked lines along the rows
-                candidate_rows = {s.row for s in c}
-                if len(candidate_rows) == 1:
-                    # Found a naked line
-                    for r in candidate_rows:
+            if candidate_rows[i]:
+                # Check for naked lines along the rows and the columns
+                for lines, r_mask in ((self.grid.rows, candidate_rows[i]), (self.grid.columns, candidate_columns[i])):
+                    if POPCOUNT[r_mask] == 1:
+                        # Found a naked line
+                        r = lines[LOWEST_BIT[r_mask]]
                         affected_this_iteration = False
+                        start = len(self.grid.move_stack)
                         for s in r.unsolved_squares:
-                            if s not in c:
+                            if s.box is not self:
                                 affected_this_iteration |= s.remove_candidate(i)
                         if affected_this_iteration:
                             affected_grid = True
-                            logging.info("Found a naked line on {value}s in {unit1} {index1}, {unit2} {index2}".format(
-                                unit1=self.unit,
-                                index1=self.index + 1,
-                                unit2=r.unit,
-                                index2=r.index + 1,
-                                value=i))
-                # Check for naked lines along the columns
-                candidate_columns = {s.column for s in c}
-                if len(candidate_columns) == 1:
-                    # Found a naked line
-                    for r in candidate_columns:
-                        affected_this_iteration = False
-                        for s in r.unsolved_squares:
-                            if s not in c:
-                                affected_this_iteration |= s.remove_candidate(i)
-                        if affected_this_iteration:
-                            affected_grid = True
-                            logging.info("Found a naked line on {value}s in {unit1} {index1}, {unit2} {index2}".format(
-                                unit1=self.unit,
-                                index1=self.index + 1,
-                                unit2=r.unit,
-                                index2=r.index + 1,
-                                value=i))
+                            if self.grid.observers:
+                                self.grid.notify("Naked line", ((self.unit, self.index), (r.unit, r.index)),
+                                    1 << (i - 1), 3, start)
         return affected_grid
 
     def find_hidden_lines(self):
@@ -379,30 +546,26 @@ class Unit:
         if self.unit not in ("Row", "Column"):
             return False
 
-        candidate_squares = {i: set() for i in Square.digits}
-        # Find the candidate squares for each unsolved number in the row/column
+        candidate_boxes = [0] * 10
+        # Find the candidate boxes for each unsolved number in the row/column
         for s in self.unsolved_squares:
-            for i in s.candidates:
-                candidate_squares[i].add(s)
-        for i, c in candidate_squares.items():
-            # If we have at least one candidate square for i in the row/column
-            if c:
-                candidate_boxes = {s.box for s in c}
-                if len(candidate_boxes) == 1:
-                    # Found a hidden line
-                    for b in candidate_boxes:
-                        affected_this_iteration = False
-                        for s in b.unsolved_squares:
-                            if s not in c:
-                                affected_this_iteration |= s.remove_candidate(i)
-                        if affected_this_iteration:
-                            affected_grid = True
-                            logging.info("Found a hidden line on {value}s in {unit1} {index1}, {unit2} {index2}".format(
-                                unit1=self.unit,
-                                index1=self.index + 1,
-                                unit2=b.unit,
-                                index2=b.index + 1,
-                                value=i))
+            for i in MASK_DIGITS[s.mask]:
+                candidate_boxes[i] |= 1 << s.box.index
+        for i in Square.digits:
+            # If the candidate squares for i in the row/column are all in the same box
+            if POPCOUNT[candidate_boxes[i]] == 1:
+                # Found a hidden line
+                b = self.grid.boxes[LOWEST_BIT[candidate_boxes[i]]]
+                affected_this_iteration = False
+                start = len(self.grid.move_stack)
+                for s in b.unsolved_squares:
+                    if (s.row if self.unit == "Row" else s.column) is not self:
+                        affected_this_iteration |= s.remove_candidate(i)
+                if affected_this_iteration:
+                    affected_grid = True
+                    if self.grid.observers:
+                        self.grid.notify("Hidden line", ((self.unit, self.index), (b.unit, b.index)),
+                            1 << (i - 1), 3, start)
         return affected_grid
 
     def is_valid(self):
@@ -416,182 +579,375 @@ class Unit:
     def __str__(self):
         return "{} {}".format(self.unit, self.index)
 
+def _insert_square(squares, s):
+    """Insert a square into a list of squares sorted by index."""
+    k = len(squares)
+    while k and squares[k - 1].index > s.index:
+        k -= 1
+    squares.insert(k, s)
+
 class Grid:
     """A Sudoku grid"""
 
     def __init__(self, values):
-        self.squares = []
+        # Values of the squares (0 for unsolved squares) and their candidate masks, viewed by the Square and Unit
+        # instances of the grid
+        self.givens = tuple(values)
+        self.values = list(values)
+        self.masks = [0 if v else ALL_CANDIDATES for v in values]
         self.rows = [Unit(self, "Row", i) for i in range(9)]
         self.columns = [Unit(self, "Column", i) for i in range(9)]
         self.boxes = [Unit(self, "Box", i) for i in range(9)]
-        self.unsolved_squares = []
+        self.lines = self.rows + self.columns
+        units = self.units = self.lines + self.boxes
+        self.squares = [Square(self, i, *[units[u] for u in SQUARE_UNITS[i]]) for i in range(81)]
+        self.unsolved_squares = [s for s in self.squares if not values[s.index]]
+        for u in units:
+            u._unsolved_squares = [s for s in u.squares if not values[s.index]]
+        # Packed moves, see format_move()
+        self.move_stack = array.array(MOVE_TYPECODE)
+        # SolverStats instance, if statistics are being collected
+        self.stats = None
+        # Seconds spent by each technique with a time budget, see Scheduler
+        self.technique_time = {}
+        # time.perf_counter() value and function returning True once solving should stop, see check_deadline()
+        self.deadline = None
+        self.cancel = None
+        # Functions called with a Deduction for each successful technique, see subscribe(). The -v log output is
+        # one of them.
+        self.observers = [log_deduction] if logging.getLogger().isEnabledFor(logging.INFO) else []
+        # Incremented whenever a digit is removed from the candidates of a square, indexed by digit
+        self.digit_generations = [0] * 10
+        # (technique, digit) -> generation of the digit when the technique last found nothing for it
+        self.digits_clean = {}
+        # Positions of each digit, indexed by digit and row (column), as masks of columns (rows), and indexed by
+        # digit and box, as masks of the positions within the box
+        self.row_positions = [[0] * 9 for i in range(10)]
+        self.column_positions = [[0] * 9 for i in range(10)]
+        self.box_positions = [[0] * 9 for i in range(10)]
+        # The first Contradiction found in the grid, see contradict()
+        self.contradiction = None
+        # Work queues of squares which may be naked singles and units which may contain hidden singles
+        self.singles = collections.deque()
+        self.pending_units = collections.deque()
 
         for i, v in enumerate(values):
-            # Determine cell position
-            row_index = i // 9
-            column_index = i % 9
-            box_index = ((row_index // 3) * 3) + (column_index // 3)
-
-            # Create the Square instance
-            s = Square(self, i, self.rows[row_index], self.columns[column_index], self.boxes[box_index], v)
-
-    def is_solved(self):
-        for s in self.squares:
-            if s.value is None:
-                return False
-        return True
+            if v:
+                for u in SQUARE_UNITS[i]:
+                    if units[u].placed & 1 << (v - 1) and self.contradiction is None:
+                        self.contradiction = Contradiction("Duplicate {} in {} {}".format(v, units[u].unit,
+                            units[u].index + 1))
+                    units[u].placed |= 1 << (v - 1)
+
+        # Remove the given values from the candidates of their peers, queueing the singles like Square.remove_mask()
+        # would. Invalid puzzles are still set up completely, keeping the first contradiction found.
+        masks = self.masks
+        for i, v in enumerate(values):
+            if v:
+                bit = 1 << (v - 1)
+                for j in PEER_INDICES[i]:
+                    m = masks[j]
+                    if m & bit:
+                        m ^= bit
+                        masks[j] = m
+                        self.move_stack.append(j << 11 | MOVE_REMOVE << 9 | bit)
+                        if POPCOUNT[m] == 1:
+                            self.singles.append(self.squares[j])
+                        for u in SQUARE_UNITS[j]:
+                            if not units[u].pending:
+                                self.pending_units.append(units[u])
+                            units[u].pending |= bit
+                        if not m and self.contradiction is None:
+                            self.contradiction = Contradiction("No candidates left in square {}".format(j))
+
+        for i, m in enumerate(masks):
+            r, c, b, column_bit, row_bit, box_bit = SQUARE_POSITIONS[i]
+            for d in MASK_DIGITS[m]:
+                self.row_positions[d][r] |= column_bit
+                self.column_positions[d][c] |= row_bit
+                self.box_positions[d][b] |= box_bit
+        if self.contradiction is None:
+            for u in units:
+                covered = u.placed
+                for i in u._indices:
+                    covered |= masks[i]
+                if covered != ALL_CANDIDATES:
+                    self.contradiction = Contradiction("No place left for {} in {} {}".format(
+                        LOWEST_BIT[ALL_CANDIDATES & ~covered] + 1, u.unit, u.index + 1))
+                    break
 
-    def is_valid(self):
-        return all([x.is_valid() for x in self.rows + self.columns + self.boxes])
+    def contradict(self, message):
+        """Raise a Contradiction, keeping the first one found in the contradiction attribute."""
+        e = Contradiction(message)
+        if self.contradiction is None:
+            self.contradiction = e
+        raise e
+
+    def check_deadline(self):
+        """Raise Interrupted if the deadline has passed or the cancel function returns True.
+
+        Called between techniques and inside the subset and fish enumerations, so that solving stops soon after.
+        """
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise Interrupted(SOLVE_TIMED_OUT, "Ran out of time")
+        if self.cancel is not None and self.cancel():
+            raise Interrupted(SOLVE_CANCELLED, "Cancelled")
+
+    def subscribe(self, observer):
+        """Call observer with a Deduction for each successful technique."""
+        self.observers.append(observer)
+
+    def unsubscribe(self, observer):
+        self.observers.remove(observer)
+
+    def notify(self, technique, units, digits, size, start):
+        """Send the observers a Deduction with the candidates removed since move index start.
+
+        Techniques only build and send deductions if there are observers.
+        """
+        eliminations = tuple([(m >> 11 & 0x7F, m & ALL_CANDIDATES) for m in self.move_stack[start:]
+            if m >> 9 & 3 == MOVE_REMOVE])
+        event = Deduction(technique, units, digits, size, eliminations)
+        for observer in self.observers:
+            observer(event)
+
+    def run_technique(self, name, technique, *args):
+        """Run a technique, a function returning True if it affected the grid, recording statistics if enabled."""
+        if self.stats is None:
+            return technique(*args)
+        moves = len(self.move_stack)
+        start = time.perf_counter()
+        affected_grid = technique(*args)
+        elapsed = time.perf_counter() - start
+        self.stats.record(name, affected_grid, count_eliminations(self.move_stack, moves), elapsed)
+        return affected_grid
 
     @staticmethod
-    def __find_x_wing(i, rows, rows_label, columns):
-        """Internal function that does the actual X-Wing detection."""
+    def find_in_units(units, method, *args):
+        """Apply a Unit technique to each of the units. Returns True if any of them affected the grid.
+
+        Between rollbacks candidates are only removed, so a unit in which the technique found nothing cannot yield a
+        result until the unit changes: such units are skipped. Grid.rollback() forgets them all.
+        """
         affected_grid = False
-        # Look for an X-Wing in the "rows"
-        positions = {j: set() for j in range(9)}
-        # Find the sets of positions of number i in the "rows"
-        for j, r in enumerate(rows):
-            for k, s in enumerate(r.squares):
-                if i in s.candidates:
-                    positions[j].add(k)
-        unsolved_rows = set([j for j in positions.keys() if positions[j]])
-        # Look for 2 "rows" with the number i in the same 2 positions
-        for j in sorted(unsolved_rows):
-            for k in [x for x in sorted(unsolved_rows) if x > j]:
-                union = positions[j] | positions[k]
-                if len(union) == 2:
-                    # We have found an X-Wing in the "rows": remove value i from all other candidates in the two "columns"
-                    for c in union:
-                        for z, s in enumerate(columns[c].squares):
-                            if z not in {j, k}:
-                                affected_grid |= s.remove_candidate(i)
-                    if affected_grid:
-                        logging.info("Found an X-Wing on {value}s in {label} {} and {}".format(j + 1, k + 1,
-                            value=i, label=rows_label))
-                        return True
-        return False
+        key = (method, args) if args else method
+        for u in units:
+            if u.clean.get(key) == u.generation:
+                continue
+            if method(u, *args):
+                affected_grid = True
+            else:
+                u.clean[key] = u.generation
+        return affected_grid
+
+    def propagate(self):
+        """Solve the queued naked and hidden singles, and the singles they create, until the queues are empty."""
+        solved = False
+        while self.singles or self.pending_units:
+            if self.singles:
+                # Solve a naked single
+                s = self.singles.popleft()
+                if s.value is None and POPCOUNT[s.mask] == 1:
+                    s.value = LOWEST_BIT[s.mask] + 1
+                    solved = True
+                continue
+            # Look for hidden singles among the digits removed from a unit
+            u = self.pending_units.popleft()
+            removed, u.pending = u.pending, 0
+            for i in MASK_DIGITS[removed]:
+                bit = 1 << (i - 1)
+                positions = [s for s in u.unsolved_squares if s.mask & bit]
+                if len(positions) == 1 and positions[0].value is None:
+                    start = len(self.move_stack)
+                    positions[0].value = i
+                    solved = True
+                    if self.observers:
+                        self.notify("Hidden single", ((u.unit, u.index),), bit, 1, start)
+        return solved
 
-    def __find_x_wing_rows(self, value):
-        return self.__find_x_wing(value, self.rows, "Rows", self.columns)
+    def is_solved(self):
+        return not self.unsolved_squares
 
-    def __find_x_wing_columns(self, value):
-        return self.__find_x_wing(value, self.columns, "Columns", self.rows)
+    def is_valid(self):
+        """Return False if a Contradiction has been found in the grid. Contradictions are found as soon as they
+        happen, so this does not need to check the units."""
+        return self.contradiction is None
 
-    def find_x_wings(self):
-        """Find X-Wings in the grid. This method can be called if the grid contains no unsolved singles."""
+    def fill(self, values):
+        """Assign the values of a solution string to the unsolved squares."""
+        for s in list(self.unsolved_squares):
+            if s.value is None:
+                s.value = int(values[s.index])
+        # The solution is consistent: the singles queued while filling it in are already solved
+        self.singles.clear()
+        self.pending_units.clear()
+
+    def checkpoint(self):
+        """Return a mark of the current state of the grid, to be restored with rollback().
+
+        Raises the Contradiction of an invalid grid.
+        """
+        if self.contradiction is not None:
+            raise self.contradiction
+        return len(self.move_stack)
+
+    def rollback(self, mark):
+        """Undo the moves made since checkpoint() returned mark, in time proportional to the number of moves undone.
+
+        Squares get back their values and candidates, and units their unsolved squares and placed digits. The
+        squares and units changed by the undone moves are queued again for propagate(), so that no single pending at
+        the checkpoint is lost.
+
+        What a technique found nothing in may depend on units other than the ones it was applied to (naked lines
+        look at the crossing lines, hidden lines at the boxes), and restoring candidates can create results there:
+        the records of the units and digits in which the techniques found nothing are all cleared.
+        """
+        stack = self.move_stack
+        masks = self.masks
+        while len(stack) > mark:
+            move = stack.pop()
+            i, op = move >> 11 & 0x7F, move >> 9 & 3
+            s = self.squares[i]
+            if op == MOVE_ASSIGN:
+                restored = move >> 18
+                self.values[i] = 0
+                for squares in (self.unsolved_squares, s.row.unsolved_squares, s.column.unsolved_squares,
+                        s.box.unsolved_squares):
+                    _insert_square(squares, s)
+                for u in (s.row, s.column, s.box):
+                    u.placed &= ~(move & ALL_CANDIDATES)
+            elif op == MOVE_REMOVE:
+                restored = move & ALL_CANDIDATES
+            else:
+                restored = move >> 18
+            masks[i] |= restored
+            if POPCOUNT[masks[i]] == 1:
+                self.singles.append(s)
+            for u in (s.row, s.column, s.box):
+                if not u.pending:
+                    self.pending_units.append(u)
+                u.pending |= restored
+            r, c, b, column_bit, row_bit, box_bit = SQUARE_POSITIONS[i]
+            for d in MASK_DIGITS[restored]:
+                self.row_positions[d][r] |= column_bit
+                self.column_positions[d][c] |= row_bit
+                self.box_positions[d][b] |= box_bit
+        for u in self.units:
+            u.clean.clear()
+        self.digits_clean.clear()
+        # Contradictions can only be found after a checkpoint
+        self.contradiction = None
+
+    def write_moves(self, path):
+        """Write the move stack to a file in text form, one move per line."""
+        with open(path, "w") as f_out:
+            f_out.writelines([format_move(m) + "\n" for m in self.move_stack])
+
+    def to_string(self):
+        """Return the values of the grid as an 81 character string, with zeroes for unsolved squares."""
+        return "".join([str(s.value) if s.value else "0" for s in self.squares])
+
+    def find_fish(self, n, finned=False):
+        """Find N-fishes (X-Wings, Swordfishes, Jellyfishes) in the grid, or their finned and sashimi variants if finned
+        is set. This method can be called if the grid contains no unsolved singles."""
         # If we find a number which appears in only the same N positions in N rows, we have a N-fish in the rows.
         # The transposed version applies in the columns.
-
-        unsolved_numbers = set.union(*[x.candidates for x in self.unsolved_squares])
-
-        for i in unsolved_numbers:
-            if self.__find_x_wing_rows(i):
-                return True
-            if self.__find_x_wing_columns(i):
-                return True
+        key = ("Fish", n, finned)
+        for i in Square.digits:
+            # Skip the digits which have not changed since the last search found nothing
+            if self.digits_clean.get((key, i)) == self.digit_generations[i]:
+                continue
+            self.check_deadline()
+            for positions, unit, transposed in ((self.row_positions[i], "Row", False),
+                    (self.column_positions[i], "Column", True)):
+                if finned:
+                    affected_grid = self.__find_finned_fish(i, n, positions, unit, transposed)
+                else:
+                    affected_grid = self.__find_fish(i, n, positions, unit, transposed)
+                if affected_grid:
+                    return True
+            self.digits_clean[(key, i)] = self.digit_generations[i]
         return False
 
-    @staticmethod
-    def __find_swordfish(i, rows, rows_label, columns):
-        """Internal function that does the actual Swordfish detection."""
+    def __remove_from_cover(self, i, positions, cover, base, transposed):
+        """Remove number i from the squares in the cover positions of the "rows" which are not in base."""
         affected_grid = False
-        # Look for a Swordfish in the "rows"
-        positions = {j: set() for j in range(9)}
-        # Find the sets of positions of number i in the "rows"
-        for j, r in enumerate(rows):
-            for k, s in enumerate(r.squares):
-                if i in s.candidates:
-                    positions[j].add(k)
-        unsolved_rows = set([j for j in positions.keys() if positions[j]])
-        # Look for 3 "rows" with the number i in the same 3 combined positions
-        for j in sorted(unsolved_rows):
-            for k in [x for x in sorted(unsolved_rows) if x > j]:
-                for l in [x for x in sorted(unsolved_rows) if x > k]:
-                    union = positions[j] | positions[k] | positions[l]
-                    if len(union) == 3:
-                        # We have found a Swordfish in the "rows": remove value i from all other candidates in the three "columns"
-                        for c in union:
-                            for z, s in enumerate(columns[c].squares):
-                                if z not in {j, k, l}:
-                                    affected_grid |= s.remove_candidate(i)
-                        if affected_grid:
-                            logging.info("Found a Swordfish on {value}s in {label} {}, {} and {}".format(
-                                j + 1, k + 1, l + 1,
-                                value=i, label=rows_label))
-                            return True
-        return False
-
-    def __find_swordfish_rows(self, value):
-        return self.__find_swordfish(value, self.rows, "Rows", self.columns)
-
-    def __find_swordfish_columns(self, value):
-        return self.__find_swordfish(value, self.columns, "Columns", self.rows)
-
-    def find_swordfishes(self):
-        """Find Swordfishes in the grid. This method can be called if the grid contains no unsolved singles."""
-        # If we find a number which appears in only the same N positions in N rows, we have a N-fish in the rows.
-        # The transposed version applies in the columns.
-
-        unsolved_numbers = set.union(*[x.candidates for x in self.unsolved_squares])
+        for j in range(9):
+            if not base >> j & 1:
+                for k in MASK_BITS[positions[j] & cover]:
+                    affected_grid |= self.squares[k * 9 + j if transposed else j * 9 + k].remove_candidate(i)
+        return affected_grid
 
-        for i in unsolved_numbers:
-            if self.__find_swordfish_rows(i):
-                return True
-            if self.__find_swordfish_columns(i):
+    def __find_fish(self, i, n, positions, unit, transposed):
+        """Internal function that does the actual N-fish detection in the "rows" given the positions of number i."""
+        # Look for N "rows" with the number i in the same N combined positions
+        lines = [j for j in range(9) if positions[j]]
+        for union, members in find_subsets([positions[j] for j in lines], n):
+            base = 0
+            for k in MASK_BITS[members]:
+                base |= 1 << lines[k]
+            # We have found an N-fish in the "rows": remove value i from all other candidates in the N "columns"
+            start = len(self.move_stack)
+            if self.__remove_from_cover(i, positions, union, base, transposed):
+                if self.observers:
+                    self.notify("Fish", tuple([(unit, j) for j in MASK_BITS[base]]), 1 << (i - 1), n, start)
                 return True
         return False
 
-    @staticmethod
-    def __find_jellyfish(i, rows, rows_label, columns):
-        """Internal function that does the actual Jellyfish detection."""
-        affected_grid = False
-        # Look for a Jellyfish in the "rows"
-        positions = {j: set() for j in range(9)}
-        # Find the sets of positions of number i in the "rows"
-        for j, r in enumerate(rows):
-            for k, s in enumerate(r.squares):
-                if i in s.candidates:
-                    positions[j].add(k)
-        unsolved_rows = set([j for j in positions.keys() if positions[j]])
-        # Look for 4 "rows" with the number i in the same 4 combined positions
-        for j in sorted(unsolved_rows):
-            for k in [x for x in sorted(unsolved_rows) if x > j]:
-                for l in [x for x in sorted(unsolved_rows) if x > k]:
-                    for m in [x for x in sorted(unsolved_rows) if x > l]:
-                        union = positions[j] | positions[k] | positions[l] | positions[m]
-                        if len(union) == 4:
-                            # We have found a Jellyfish in the "rows": remove value i from all other candidates in the four "columns"
-                            for c in union:
-                                for z, s in enumerate(columns[c].squares):
-                                    if z not in {j, k, l, m}:
-                                        affected_grid |= s.remove_candidate(i)
-                            if affected_grid:
-                                logging.info("Found a Jellyfish on {value}s in {label} {}, {}, {} and {}".format(
-                                    j + 1, k + 1, l + 1, m + 1,
-                                    value=i, label=rows_label))
-                                return True
+    def __find_finned_fish(self, i, n, positions, unit, transposed):
+        """Internal function that does the actual finned/sashimi N-fish detection in the "rows"."""
+        # If the positions of number i in N "rows" cover N "columns" except for some fins which all lie in one box,
+        # either the fish holds or a fin is the solution: the number can be removed from the squares of the
+        # "columns" which see all the fins, i.e. those in the box of the fins.
+        lines = [j for j in range(9) if positions[j]]
+        for base_lines in itertools.combinations(lines, n):
+            union = 0
+            for j in base_lines:
+                union |= positions[j]
+            if not n < POPCOUNT[union] <= n + 3:
+                continue
+            base = digit_mask([j + 1 for j in base_lines])
+            for cover_lines in itertools.combinations(MASK_BITS[union], n):
+                cover = digit_mask([k + 1 for k in cover_lines])
+                # The fins are the positions outside the cover
+                fin_rows = 0
+                fin_columns = 0
+                for j in base_lines:
+                    if positions[j] & ~cover:
+                        fin_rows |= 1 << j
+                        fin_columns |= positions[j] & ~cover
+                band = 0x7 << (LOWEST_BIT[fin_rows] // 3 * 3)
+                stack = 0x7 << (LOWEST_BIT[fin_columns] // 3 * 3)
+                if fin_rows & ~band or fin_columns & ~stack:
+                    # The fins are not in a single box
+                    continue
+                # Remove number i from the cover squares in the box of the fins, outside the base "rows"
+                affected_grid = False
+                start = len(self.move_stack)
+                for j in MASK_BITS[band & ~base]:
+                    for k in MASK_BITS[positions[j] & cover & stack]:
+                        affected_grid |= self.squares[k * 9 + j if transposed else j * 9 + k].remove_candidate(i)
+                if affected_grid:
+                    if self.observers:
+                        # In a sashimi fish, a base "row" only has positions in the fins and one cover "column"
+                        sashimi = any([POPCOUNT[positions[j] & cover] < 2 and positions[j] & ~cover
+                            for j in base_lines])
+                        self.notify("Sashimi fish" if sashimi else "Finned fish", tuple([(unit, j) for j in base_lines]),
+                            1 << (i - 1), n, start)
+                    return True
         return False
 
-    def __find_jellyfish_rows(self, value):
-        return self.__find_jellyfish(value, self.rows, "Rows", self.columns)
+    def find_x_wings(self):
+        """Find X-Wings in the grid. This method can be called if the grid contains no unsolved singles."""
+        return self.find_fish(2)
 
-    def __find_jellyfish_columns(self, value):
-        return self.__find_jellyfish(value, self.columns, "Columns", self.rows)
+    def find_swordfishes(self):
+        """Find Swordfishes in the grid. This method can be called if the grid contains no unsolved singles."""
+        return self.find_fish(3)
 
     def find_jellyfishes(self):
         """Find Jellyfishes in the grid. This method can be called if the grid contains no unsolved singles."""
-        # If we find a number which appears in only the same N positions in N rows, we have a N-fish in the rows.
-        # The transposed version applies in the columns.
-
-        unsolved_numbers = set.union(*[x.candidates for x in self.unsolved_squares])
-
-        for i in unsolved_numbers:
-            if self.__find_jellyfish_rows(i):
-                return True
-            if self.__find_jellyfish_columns(i):
-                return True
-        return False
+        return self.find_fish(4)
 
     def __str__(self):
         out = ""
@@ -609,7 +965,7 @@ class Grid:
                                 given="*" if s.given and c_r == 1 else " ")
                     else:
                         for e in range((c_r * 3) + 1, (c_r + 1) * 3 + 1):
-                            out += " {}".format(e if e in s.candidates else " ")
+                            out += " {}".format(e if s.mask >> (e - 1) & 1 else " ")
                     separator = " │"
                     if j in (2, 5):
                         separator = " ║"
@@ -636,10 +992,572 @@ class Grid:
                     out += "{}{}".format(separator, corner)
         return out
 
+class SolverStats:
+    """Per-technique statistics: invocations, successful invocations, candidates eliminated and time spent"""
+
+    def __init__(self, techniques=None):
+        # Technique name -> [invocations, successful invocations, candidates eliminated, seconds]
+        self.techniques = {name: list(t) for name, t in techniques.items()} if techniques else {}
+
+    def record(self, name, affected_grid, eliminated, elapsed):
+        t = self.techniques.get(name)
+        if t is None:
+            t = self.techniques[name] = [0, 0, 0, 0.0]
+        t[0] += 1
+        t[1] += 1 if affected_grid else 0
+        t[2] += eliminated
+        t[3] += elapsed
+
+    def merge(self, other):
+        """Add the statistics of another SolverStats instance, or of the dictionary returned by to_dict()."""
+        techniques = other.techniques if isinstance(other, SolverStats) else other
+        for name, t in techniques.items():
+            mine = self.techniques.setdefault(name, [0, 0, 0, 0.0])
+            for i, v in enumerate(t):
+                mine[i] += v
+
+    def to_dict(self):
+        return {name: list(t) for name, t in self.techniques.items()}
+
+    def __str__(self):
+        out = "{:<20} {:>10} {:>10} {:>8} {:>11} {:>12}\n".format(
+            "Technique", "Calls", "Hits", "Hit rate", "Eliminated", "Time (ms)")
+        for name, (calls, hits, eliminated, elapsed) in self.techniques.items():
+            out += "{:<20} {:>10} {:>10} {:>8.1%} {:>11} {:>12.3f}\n".format(
+                name, calls, hits, hits / calls if calls else 0.0, eliminated, elapsed * 1000)
+        return out
+
+# A solving technique: function is applied with args to each unit of the grid attribute named by units through
+# Grid.find_in_units(), or to the grid itself if units is None, and returns True if it affected the grid. cost is an
+# estimate of the microseconds taken by a call, used to try the cheapest techniques first.
+Technique = collections.namedtuple("Technique", ("name", "cost", "units", "function", "args"))
+
+# Registry of the techniques applied by Puzzle.update_notation(), from the simplest to the most advanced
+TECHNIQUES = (
+    Technique("Naked lines", 80, "boxes", Unit.find_naked_lines, ()),
+    Technique("Hidden lines", 70, "lines", Unit.find_hidden_lines, ()),
+) + tuple(Technique("{} {}s".format(kind, SUBSET_NAMES[n]), cost + 30 * n, "units", function, (n,))
+    for n in range(2, len(SUBSET_NAMES))
+    for kind, cost, function in (("Naked", 50, Unit.find_naked_subsets), ("Hidden", 80, Unit.find_hidden_subsets))
+) + (
+    Technique("X-Wings", 100, None, Grid.find_fish, (2,)),
+    Technique("Swordfishes", 100, None, Grid.find_fish, (3,)),
+    Technique("Jellyfishes", 110, None, Grid.find_fish, (4,)),
+    Technique("Finned X-Wings", 900, None, Grid.find_fish, (2, True)),
+    Technique("Finned Swordfishes", 3400, None, Grid.find_fish, (3, True)),
+    Technique("Finned Jellyfishes", 6200, None, Grid.find_fish, (4, True)),
+)
+TECHNIQUE_NAMES = tuple(t.name for t in TECHNIQUES)
+FINNED_FISH_NAMES = ("Finned X-Wings", "Finned Swordfishes", "Finned Jellyfishes")
+
+# Techniques applied together by the fixed scheduling policy, in order, and whether they are repeated until they
+# stall: intersection removal is repeated, and pairs and triples are looked for together
+FIXED_TIERS = (
+    (("Naked lines", "Hidden lines"), True),
+    (("Naked pairs", "Hidden pairs", "Naked triples", "Hidden triples"), False),
+) + tuple((("Naked {}s".format(SUBSET_NAMES[n]), "Hidden {}s".format(SUBSET_NAMES[n])), False)
+    for n in range(4, len(SUBSET_NAMES))
+) + tuple(((name,), False) for name in ("X-Wings", "Swordfishes", "Jellyfishes") + FINNED_FISH_NAMES)
+SCHEDULER_POLICIES = ("fixed", "cheapest", "adaptive")
+# Number of rounds between two reorderings of the techniques by the adaptive scheduling policy
+SCHEDULER_REORDER = 256
+
+class Scheduler:
+    """Choose the techniques applied by Puzzle.update_notation() and the order they are tried in.
+
+    Each round applies the techniques until one of them makes progress, according to the policy:
+    - fixed: from the simplest to the most advanced, in the tiers of FIXED_TIERS
+    - cheapest: one at a time from the lowest cost estimate
+    - adaptive: one at a time from the lowest measured time per successful call, counting the cost estimate as one
+      more successful call, and reordering every SCHEDULER_REORDER rounds. Bulk runs keep a Scheduler per process,
+      so the order adapts to the puzzles being solved.
+
+    Subsets larger than max_subset, finned fishes unless finned_fish is set, and the disabled techniques are never
+    applied. budgets maps technique names to the seconds they may spend on each puzzle, after which they are skipped.
+    """
+
+    def __init__(self, max_subset=MAX_SUBSET, finned_fish=False, policy="fixed", disabled=(), budgets=None):
+        if policy not in SCHEDULER_POLICIES:
+            raise ValueError("Unknown scheduling policy {}".format(policy))
+        excluded = set(disabled)
+        excluded.update(["{} {}s".format(kind, SUBSET_NAMES[n]) for kind in ("Naked", "Hidden")
+            for n in range(max_subset + 1, len(SUBSET_NAMES))])
+        if not finned_fish:
+            excluded.update(FINNED_FISH_NAMES)
+        self.policy = policy
+        self.techniques = [t for t in TECHNIQUES if t.name not in excluded]
+        self.budgets = dict(budgets) if budgets else {}
+        self.rounds = 0
+        # Statistics of the techniques over all the puzzles, measured by the adaptive policy
+        self.measured = SolverStats() if policy == "adaptive" else None
+        if policy == "fixed":
+            by_name = {t.name: t for t in self.techniques}
+            tiers = [([by_name[name] for name in names if name in by_name], repeat) for names, repeat in FIXED_TIERS]
+            self.tiers = [(tier, repeat) for tier, repeat in tiers if tier]
+        else:
+            self.tiers = [([t], False) for t in sorted(self.techniques, key=lambda t: t.cost)]
+
+    def order(self):
+        """Return the names of the techniques in the order they are tried."""
+        return [t.name for tier, _ in self.tiers for t in tier]
+
+    def reorder(self):
+        """Order the techniques by their measured time per successful call, from the cheapest."""
+        def score(t):
+            calls, hits, eliminated, elapsed = self.measured.techniques.get(t.name, (0, 0, 0, 0.0))
+            return (elapsed * 1e6 + t.cost) / (hits + 1)
+        self.tiers = [([t], False) for t in sorted(self.techniques, key=score)]
+        logging.debug("Technique order: {}".format(", ".join(self.order())))
+
+    def run(self, grid):
+        """Apply the techniques to a grid until one of them makes progress. Returns True if the grid was affected."""
+        if self.measured is not None:
+            self.rounds += 1
+            if self.rounds % SCHEDULER_REORDER == 0:
+                self.reorder()
+        for tier, repeat in self.tiers:
+            affected_grid = False
+            while True:
+                affected_this_iteration = False
+                for t in tier:
+                    affected_this_iteration |= self.apply(grid, t)
+                if affected_this_iteration:
+                    affected_grid = True
+                if not (repeat and affected_this_iteration):
+                    break
+            if affected_grid:
+                return True
+        return False
+
+    def apply(self, grid, t):
+        """Apply a technique to a grid unless it has used up its time budget. Returns True if it affected the grid."""
+        grid.check_deadline()
+        if t.units is None:
+            args = (t.function, grid) + t.args
+        else:
+            args = (grid.find_in_units, getattr(grid, t.units), t.function) + t.args
+        budget = self.budgets.get(t.name)
+        if budget is None and self.measured is None:
+            return grid.run_technique(t.name, *args)
+        if budget is not None and grid.technique_time.get(t.name, 0.0) >= budget:
+            return False
+        moves = len(grid.move_stack)
+        start = time.perf_counter()
+        affected_grid = grid.run_technique(t.name, *args)
+        elapsed = time.perf_counter() - start
+        if budget is not None:
+            grid.technique_time[t.name] = grid.technique_time.get(t.name, 0.0) + elapsed
+        if self.measured is not None:
+            self.measured.record(t.name, affected_grid, count_eliminations(grid.move_stack, moves), elapsed)
+        return affected_grid
+
+class SearchTimeout(Exception):
+    """Raised when a search exceeds its time limit"""
+    pass
+
+class Search:
+    """Depth-first search with constraint propagation, used when logic alone cannot solve a puzzle.
+
+    The search works on a list of 81 candidate masks, where solved squares hold the mask of their value. At each
+    node it branches on the unsolved square with the fewest candidates, and every assignment is propagated to
+    the peers of the square (naked singles) and to the units of the square (hidden singles).
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self.nodes = 0
+        self.elapsed = 0.0
+        self._deadline = None
+
+    @staticmethod
+    def grid_masks(grid):
+        """Return the candidate masks of a grid, using the mask of the value for solved squares."""
+        return [1 << (v - 1) if v else m for v, m in zip(grid.values, grid.masks)]
+
+    @staticmethod
+    def to_string(masks):
+        """Return the values of a list of masks as an 81 character string, with zeroes for unsolved squares."""
+        return "".join([str(LOWEST_BIT[m] + 1) if POPCOUNT[m] == 1 else "0" for m in masks])
+
+    def solve(self, masks):
+        """Return the masks of a solution extending the provided masks, or None if there is none.
+
+        Raises SearchTimeout if no result was found within the time limit.
+        """
+        solutions = self.solutions(masks, 1)
+        return solutions[0] if solutions else None
+
+    def count(self, masks, limit=2):
+        """Return the number of solutions extending the provided masks, counting at most limit of them.
+
+        Raises SearchTimeout if no result was found within the time limit.
+        """
+        return len(self.solutions(masks, limit))
+
+    def solutions(self, masks, limit=None):
+        """Return a list of the masks of the solutions extending the provided masks, stopping once limit solutions
+        have been found.
+
+        Raises SearchTimeout if no result was found within the time limit.
+        """
+        start = time.perf_counter()
+        self.nodes = 0
+        self._deadline = start + self.timeout if self.timeout is not None else None
+        found = []
+        try:
+            masks = list(masks)
+            # Propagate any unsolved singles before starting the search
+            for i, m in enumerate(masks):
+                if not m:
+                    return found
+                if POPCOUNT[m] == 1:
+                    for p in PEER_INDICES[i]:
+                        if not self._eliminate(masks, p, m):
+                            return found
+            self._search(masks, found, limit)
+            return found
+        finally:
+            self.elapsed = time.perf_counter() - start
+
+    def _search(self, masks, found, limit):
+        """Add the solutions extending masks to found. Returns True once limit solutions have been found."""
+        self.nodes += 1
+        if self._deadline is not None and time.perf_counter() > self._deadline:
+            raise SearchTimeout("Search timed out after {} nodes".format(self.nodes))
+        # Branch on the square with the fewest candidates
+        best = None
+        best_count = 10
+        for i, m in enumerate(masks):
+            c = POPCOUNT[m]
+            if 1 < c < best_count:
+                best, best_count = i, c
+                if c == 2:
+                    break
+        if best is None:
+            # All squares have a single candidate
+            found.append(masks)
+            return limit is not None and len(found) >= limit
+        for b in MASK_BITS[masks[best]]:
+            branch = masks[:]
+            if self._assign(branch, best, 1 << b) and self._search(branch, found, limit):
+                return True
+        return False
+
+    def _assign(self, masks, i, bit):
+        """Assign the digit in bit to square i, returning False on a contradiction."""
+        for b in MASK_BITS[masks[i] & ~bit]:
+            if not self._eliminate(masks, i, 1 << b):
+                return False
+        return True
+
+    def _eliminate(self, masks, i, bit):
+        """Remove the digit in bit from the candidates of square i, returning False on a contradiction."""
+        if not masks[i] & bit:
+            return True
+        m = masks[i] = masks[i] & ~bit
+        if not m:
+            return False
+        if POPCOUNT[m] == 1:
+            # Naked single: remove its value from the peers
+            for p in PEER_INDICES[i]:
+                if not self._eliminate(masks, p, m):
+                    return False
+        for u in SQUARE_UNITS[i]:
+            places = [j for j in UNIT_INDICES[u] if masks[j] & bit]
+            if not places:
+                return False
+            if len(places) == 1 and masks[places[0]] != bit:
+                # Hidden single
+                if not self._assign(masks, places[0], bit):
+                    return False
+        return True
+
+class BatchSolver:
+    """Solve a batch of puzzles at once with naked singles, hidden singles and intersections, using NumPy.
+
+    The batch is an (N, 81) array of candidate masks, and every technique is applied to all the puzzles of the batch
+    with array operations over the static index tables. Puzzles are propagated until they stop changing, and those
+    which are not solved this way are left to the Puzzle solver.
+    """
+
+    def __init__(self):
+        if numpy is None:
+            raise ValueError("The batch solver requires NumPy")
+        # Intersections of a box with a row or column, with the rest of the box and the rest of the line
+        segments, box_rest, line_rest = [], [], []
+        for box in BOX_INDICES:
+            for line in ROW_INDICES + COLUMN_INDICES:
+                segment = [i for i in line if i in box]
+                if segment:
+                    segments.append(segment)
+                    box_rest.append([i for i in box if i not in segment])
+                    line_rest.append([i for i in line if i not in segment])
+        self.peers = numpy.array(PEER_INDICES)
+        self.units = numpy.array(UNIT_INDICES)
+        self.square_units = numpy.array(SQUARE_UNITS)
+        self.segments = numpy.array(segments)
+        self.box_rest = numpy.array(box_rest)
+        self.line_rest = numpy.array(line_rest)
+        # Intersections whose rest of the line (box) contains each square
+        self.line_rest_of = numpy.array([[k for k, rest in enumerate(line_rest) if i in rest] for i in range(81)])
+        self.box_rest_of = numpy.array([[k for k, rest in enumerate(box_rest) if i in rest] for i in range(81)])
+        self.popcount = numpy.array(POPCOUNT, dtype=numpy.uint8)
+        self.digits = numpy.array([ord(str(LOWEST_BIT[m] + 1)) if POPCOUNT[m] == 1 else ord("0")
+            for m in range(1 << 9)], dtype=numpy.uint8)
+
+    def masks(self, puzzles):
+        """Return the (N, 81) array of candidate masks of a list of puzzle strings."""
+        digits = numpy.frombuffer("".join(puzzles).encode(), dtype=numpy.uint8).reshape(-1, 81)
+        digits = digits.astype(numpy.int16) - ord("0")
+        return numpy.where(digits > 0, 1 << numpy.maximum(digits - 1, 0), ALL_CANDIDATES).astype(numpy.uint16)
+
+    def step(self, masks):
+        """Apply each technique once to an array of candidate masks.
+
+        Returns the new masks and a boolean array marking the puzzles found to be invalid.
+        """
+        # Naked singles: remove the values of solved squares from their peers
+        values = numpy.where(self.popcount[masks] == 1, masks, 0)
+        masks = masks & ~numpy.bitwise_or.reduce(values[:, self.peers], axis=2)
+        # Hidden singles: find the digits with a single position in each unit
+        units = masks[:, self.units]
+        once = numpy.zeros(units.shape[:2], dtype=numpy.uint16)
+        twice = numpy.zeros(units.shape[:2], dtype=numpy.uint16)
+        for k in range(9):
+            twice |= once & units[:, :, k]
+            once |= units[:, :, k]
+        hidden = numpy.bitwise_or.reduce(masks[:, :, None] & (once & ~twice)[:, self.square_units], axis=2)
+        masks = numpy.where(hidden != 0, hidden, masks)
+        # Intersections: digits of a box confined to a line are removed from the rest of the line, and vice versa
+        segments = numpy.bitwise_or.reduce(masks[:, self.segments], axis=2)
+        pointing = segments & ~numpy.bitwise_or.reduce(masks[:, self.box_rest], axis=2)
+        claiming = segments & ~numpy.bitwise_or.reduce(masks[:, self.line_rest], axis=2)
+        masks = masks & ~(numpy.bitwise_or.reduce(pointing[:, self.line_rest_of], axis=2) |
+            numpy.bitwise_or.reduce(claiming[:, self.box_rest_of], axis=2))
+        invalid = (masks == 0).any(axis=1) | (once != ALL_CANDIDATES).any(axis=1)
+        return masks, invalid
+
+    def solve(self, puzzles):
+        """Return the solution string of each of a list of puzzle strings, or None if it could not be solved."""
+        if not puzzles:
+            return []
+        masks = self.masks(puzzles)
+        invalid = numpy.zeros(len(puzzles), dtype=bool)
+        # Only keep propagating the puzzles which changed in the last step
+        active = numpy.arange(len(puzzles))
+        while active.size:
+            before = masks[active]
+            after, broken = self.step(before)
+            masks[active] = after
+            invalid[active] = broken
+            active = active[(after != before).any(axis=1) & ~broken]
+        solved = (self.popcount[masks] == 1).all(axis=1) & ~invalid
+        strings = self.digits[masks]
+        return [strings[k].tobytes().decode() if solved[k] else None for k in range(len(puzzles))]
+
+def _transpose(digits):
+    """Return the transpose of a list of 81 digits."""
+    return [digits[(i % 9) * 9 + i // 9] for i in range(81)]
+
+def _ranks(keys):
+    """Replace each of a list of sortable keys by its rank among the distinct keys."""
+    ranks = {k: i for i, k in enumerate(sorted(set(keys)))}
+    return [ranks[k] for k in keys]
+
+def _line_keys(digits):
+    """Return invariant keys of the rows and of the columns of a list of 81 digits.
+
+    The keys do not depend on the labels of the digits, and permuting the rows (columns) of the grid within the
+    symmetries permutes the row (column) keys in the same way, leaving the column (row) keys unchanged. Squares start
+    from the number of occurrences of their digit, and are refined CANONICAL_ROUNDS times with the keys of their row,
+    column, box and digit.
+    """
+    counts = [0] * 10
+    for d in digits:
+        counts[d] += 1
+    colors = [counts[d] if d else 0 for d in digits]
+    for k in range(CANONICAL_ROUNDS + 1):
+        rows = _ranks([tuple(sorted([colors[i] for i in squares])) for squares in ROW_INDICES])
+        columns = _ranks([tuple(sorted([colors[i] for i in squares])) for squares in COLUMN_INDICES])
+        if k == CANONICAL_ROUNDS:
+            return rows, columns
+        boxes = _ranks([tuple(sorted([colors[i] for i in squares])) for squares in BOX_INDICES])
+        squares = [[] for _ in range(10)]
+        for i, d in enumerate(digits):
+            squares[d].append(colors[i])
+        labels = _ranks([tuple(sorted(s)) for s in squares])
+        colors = _ranks([(colors[i], rows[r], columns[c], boxes[b], labels[d] if d else -1)
+            for i, (d, (r, c, b, _, _, _)) in enumerate(zip(digits, SQUARE_POSITIONS))])
+
+def _line_orders(keys):
+    """Return the orders of the rows (columns) sorting the bands (stacks) and the rows (columns) within each band
+    (stack) by their keys, with all the orders of the lines with equal keys."""
+    def orders(items, key):
+        # All the orders of the items sorted by key, permuting the items with equal keys
+        groups = [list(g) for _, g in itertools.groupby(sorted(items, key=key), key=key)]
+        return [sum(p, ()) for p in itertools.product(*[list(itertools.permutations(g)) for g in groups])]
+    inner = [orders(range(b * 3, b * 3 + 3), keys.__getitem__) for b in range(3)]
+    return [sum(lines, ()) for bands in orders(range(3), lambda b: sorted(keys[b * 3:b * 3 + 3]))
+        for lines in itertools.product(*[inner[b] for b in bands])]
+
+def canonicalize(values):
+    """Map a puzzle string to its canonical form under the Sudoku symmetries.
+
+    The symmetries are transposition, permutations of the bands and stacks, permutations of the rows (columns)
+    within each band (stack) and relabelling of the digits. The rows and columns of the grid, or of its transpose,
+    are sorted by keys which are invariant under the symmetries, see _line_keys(), and the digits are relabelled in
+    order of appearance. The canonical form is the smallest such puzzle string, with zeroes for empty squares, over
+    the orders of lines with equal keys. Returns a tuple of the canonical string and the transform producing it, to
+    be used with apply_transform() and invert_transform().
+
+    Puzzles with more than CANONICAL_STATES such orders are not canonicalized, and (None, None) is returned. All the
+    puzzles equivalent to such a puzzle have as many.
+    """
+    digits = [int(x) for x in Puzzle.normalize(values)]
+    # Keep the grid or its transpose, or both if their sorted keys are the same
+    sides = []
+    for transposed, grid in enumerate((digits, _transpose(digits))):
+        rows, columns = _line_keys(grid)
+        sides.append(((sorted(rows), sorted(columns)), bool(transposed), grid, rows, columns))
+    smallest = min([side[0] for side in sides])
+    candidates = [(transposed, grid, _line_orders(rows), _line_orders(columns))
+        for key, transposed, grid, rows, columns in sides if key == smallest]
+    if sum([len(row_orders) * len(column_orders) for _, _, row_orders, column_orders in candidates]) > \
+            CANONICAL_STATES:
+        return None, None
+    best = None
+    for transposed, grid, row_orders, column_orders in candidates:
+        for rows in row_orders:
+            for columns in column_orders:
+                labels = [0] * 10
+                next_label = 1
+                canonical = []
+                for r in rows:
+                    for c in columns:
+                        d = grid[r * 9 + c]
+                        if d and not labels[d]:
+                            labels[d] = next_label
+                            next_label += 1
+                        canonical.append(labels[d])
+                if best is None or canonical < best[0]:
+                    best = (canonical, transposed, rows, columns, labels)
+    canonical, transposed, rows, columns, labels = best
+    # Give the labels left to the digits which do not appear in the puzzle
+    unused = iter([x for x in Square.digits if x not in labels])
+    labels = (0,) + tuple([labels[d] or next(unused) for d in Square.digits])
+    return "".join([str(x) for x in canonical]), (transposed, rows, columns, labels)
+
+def apply_transform(values, transform):
+    """Apply a transform returned by canonicalize() to a puzzle or solution string."""
+    transposed, rows, columns, labels = transform
+    digits = [int(x) for x in values]
+    grid = _transpose(digits) if transposed else digits
+    return "".join([str(labels[grid[r * 9 + c]]) for r in rows for c in columns])
+
+def invert_transform(values, transform):
+    """Map a puzzle or solution string through the inverse of a transform returned by canonicalize()."""
+    transposed, rows, columns, labels = transform
+    digits = [0] * 10
+    for d, l in enumerate(labels):
+        digits[l] = d
+    grid = [0] * 81
+    for i, x in enumerate(values):
+        grid[rows[i // 9] * 9 + columns[i % 9]] = digits[int(x)]
+    return "".join([str(x) for x in (_transpose(grid) if transposed else grid)])
+
+class SolutionCache:
+    """A bounded LRU cache of solutions, keyed by the puzzles and by their canonical form.
+
+    Repeated puzzles are found by their normalized string without computing the canonical form, and equivalent
+    puzzles by their canonical form.
+    """
+
+    def __init__(self, size=1024):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Normalized puzzle -> solution, and canonical puzzle -> canonical solution, from least to most recently used
+        self._exact = collections.OrderedDict()
+        self._solutions = collections.OrderedDict()
+
+    @staticmethod
+    def __put(solutions, key, solution, size):
+        # Add an entry to an LRU dictionary, returning True if another one was evicted to make room
+        solutions[key] = solution
+        solutions.move_to_end(key)
+        if len(solutions) > size:
+            solutions.popitem(last=False)
+            return True
+        return False
+
+    def lookup(self, values):
+        """Look up the solution of a normalized puzzle string.
+
+        Returns a tuple of the solution, or None on a miss, and of the canonical form and transform of the puzzle
+        to be passed to store(), which are None if the puzzle was found by its string.
+        """
+        solution = self._exact.get(values)
+        if solution is not None:
+            self.hits += 1
+            self._exact.move_to_end(values)
+            return solution, None, None
+        canonical, transform = canonicalize(values)
+        solution = self._solutions.get(canonical) if canonical is not None else None
+        if solution is None:
+            self.misses += 1
+            return None, canonical, transform
+        self.hits += 1
+        self._solutions.move_to_end(canonical)
+        solution = invert_transform(solution, transform)
+        self.__put(self._exact, values, solution, self.size)
+        return solution, canonical, transform
+
+    def store(self, values, canonical, transform, solution):
+        """Store the solution of a normalized puzzle string, given the canonical form and transform returned by
+        lookup()."""
+        self.__put(self._exact, values, solution, self.size)
+        if canonical is not None and self.__put(self._solutions, canonical, apply_transform(solution, transform),
+                self.size):
+            self.evictions += 1
+
+    def __str__(self):
+        lookups = self.hits + self.misses
+        return "Cache: {} hits, {} misses ({:.1%} hit rate), {} evictions".format(self.hits, self.misses,
+            self.hits / lookups if lookups else 0.0, self.evictions)
+
+# Outcomes of Puzzle.solve()
+SOLVE_SOLVED = "solved"
+SOLVE_STALLED = "stalled"
+SOLVE_TIMED_OUT = "timed-out"
+SOLVE_CANCELLED = "cancelled"
+SOLVE_INVALID = "invalid"
+
+class SolveResult(collections.namedtuple("SolveResult", ("status", "grid", "stats", "iterations", "elapsed"))):
+    """Result of Puzzle.solve(): status is one of the SOLVE_* outcomes, grid is the string of the values reached, with
+    zeroes for unsolved squares, stats is the SolverStats of the puzzle if any, and iterations and elapsed are the
+    iterations and seconds taken. True if the puzzle was solved."""
+
+    __slots__ = ()
+
+    def __bool__(self):
+        return self.status == SOLVE_SOLVED
+
 class Puzzle(Grid):
     """A Sudoku puzzle"""
 
     def __init__(self, values):
+        values = Puzzle.normalize(values)
+        Grid.__init__(self, [int(x) for x in values])
+        # Time spent and nodes visited by the search fallback, if it was used
+        self.search_time = None
+        self.search_nodes = None
+        # Whether the solution was found in the SolutionCache, if one was used
+        self.cache_hit = None
+
+    @staticmethod
+    def normalize(values):
+        """Validate a puzzle string and return it with zeroes for empty squares."""
         if len(values) != 9*9:
             raise ValueError("Wrong number of squares ({}, expected {})!".format(len(values), 9*9))
         # Support dots as empty squares as well
@@ -648,19 +1566,22 @@ class Puzzle(Grid):
         for v in values:
             if not v.isdigit():
                 raise ValueError("Invalid puzzle value {}".format(v))
-        Grid.__init__(self, [int(x) for x in values])
-        self.move_stack = []
+        return values
 
     @staticmethod
     def from_file(f):
-        s = ""
+        if is_packed_file(f):
+            # Read the first puzzle of a packed file
+            with PackedPuzzles(f) as puzzles:
+                if not len(puzzles):
+                    logging.error("Invalid file {}:\nNo puzzles in packed file".format(f))
+                    return None
+                return Puzzle(puzzles[0])
+        digits = []
         with open(f, "r") as f_in:
-            # Read 81 decimal digits from file. If the file contains anything else it is malformed.
-            while True:
-                b = f_in.read(1)
-                if not b:
-                    # We reached end of file
-                    break
+            # Read 81 decimal digits from file, up to the end of file. If the file contains anything else it is
+            # malformed.
+            for b in iter(lambda: f_in.read(1), ""):
                 if b.isspace():
                     # Ignore spaces and newlines
                     continue
@@ -668,176 +1589,924 @@ class Puzzle(Grid):
                     # Support dots as empty squares
                     b = "0"
                 if b.isdigit():
-                    s += b
-                    if len(s) == 81:
+                    digits.append(b)
+                    if len(digits) == 81:
                         # Only read 81 digits
                         break
                 else:
                     logging.error("Invalid file {}:\nInvalid character \"{}\"".format(f, b))
                     return None
+        s = "".join(digits)
         if len(s) == 81:
             return Puzzle(s)
         else:
             logging.error("Invalid file {}:\nFile too short (found {} characters, expected {})".format(f, len(s), 81))
             return None
 
-    def update_notation(self):
-        affected_grid = False
-
-        ## Simple pruning
-        # Remove candidates affected by solved squares
-        for s in self.unsolved_squares:
-            for v in set([x.value for x in s.row.squares if x.value]):
-                affected_grid |= s.remove_candidate(v)
-            for v in set([x.value for x in s.column.squares if x.value]):
-                affected_grid |= s.remove_candidate(v)
-            for v in set([x.value for x in s.box.squares if x.value]):
-                affected_grid |= s.remove_candidate(v)
-        if affected_grid:
-            logging.info("Updated notation based on new solved squares")
-
-        # Find hidden singles
-        # Due to the current design, we convert hidden singles to naked singles here,
-        # and solve them in the main function.
-        for u in self.rows + self.columns + self.boxes:
-            affected_grid |= u.find_hidden_singles()
-
-        # Solve any singles before moving on to more advanced techniques
-        if affected_grid:
-            return
-
-        ## Intersection removal
-        while True:
-            affected_this_iteration = False
-            # Find pointing pairs/triples
-            for u in self.boxes:
-                affected_this_iteration |= u.find_naked_lines()
-            # Box/line reduction
-            for u in self.rows + self.columns:
-                affected_this_iteration |= u.find_hidden_lines()
-
-            if affected_this_iteration:
-                affected_grid = True
-            else:
-                break
-
-        # Solve any singles before moving on to more advanced techniques
-        if affected_grid:
+    def update_notation(self, max_subset=MAX_SUBSET, finned_fish=False, scheduler=None):
+        """Solve the singles, or else apply the techniques chosen by the scheduler until one of them makes progress.
+
+        Without a scheduler, the techniques are applied from the simplest to the most advanced by a fixed Scheduler
+        with max_subset and finned_fish.
+        """
+        ## Constraint propagation
+        # Solved squares have already removed their value from their peers: solve the naked and hidden singles
+        # created since the last iteration before moving on to more advanced techniques
+        if self.run_technique("Singles", self.propagate):
+            logging.info("Solved singles")
             return
 
-        ## Hidden/naked N-sets
-        # Find naked pairs
-        for u in self.rows + self.columns + self.boxes:
-            affected_grid |= u.find_naked_pairs()
-
-        # Find hidden pairs
-        for u in self.rows + self.columns + self.boxes:
-            affected_grid |= u.find_hidden_pairs()
-
-        # Find naked triples
-        for u in self.rows + self.columns + self.boxes:
-            affected_grid |= u.find_naked_triples()
-
-        # Find hidden triples
-        for u in self.rows + self.columns + self.boxes:
-            affected_grid |= u.find_hidden_triples()
-
-        if affected_grid:
-            return
-
-        # Find naked quadruples
-        for u in self.rows + self.columns + self.boxes:
-            affected_grid |= u.find_naked_quadruples()
-
-        # Find hidden quadruples
-        for u in self.rows + self.columns + self.boxes:
-            affected_grid |= u.find_hidden_quadruples()
+        if scheduler is None:
+            scheduler = Scheduler(max_subset, finned_fish)
+        scheduler.run(self)
+
+    def search(self, timeout=None):
+        """Complete the puzzle with a search starting from the current candidates. Returns True on success."""
+        searcher = Search(timeout)
+        try:
+            masks = searcher.solve(Search.grid_masks(self))
+        except SearchTimeout:
+            logging.error("Search timed out after {:.3f}s".format(searcher.elapsed))
+            return False
+        finally:
+            self.search_time = searcher.elapsed
+            self.search_nodes = searcher.nodes
+        if masks is None:
+            logging.error("Puzzle has no solution!")
+            return False
+        logging.info("Search completed in %.3fs (%d nodes)", searcher.elapsed, searcher.nodes)
+        self.fill(Search.to_string(masks))
+        return True
 
-        if affected_grid:
-            return
+    def count_solutions(self, limit=2, timeout=None):
+        """Return the number of solutions of the puzzle, stopping as soon as limit solutions have been found.
+
+        The count starts from the current candidates. Raises SearchTimeout if it takes longer than timeout seconds.
+        """
+        searcher = Search(timeout)
+        try:
+            return searcher.count(Search.grid_masks(self), limit)
+        finally:
+            self.search_time = searcher.elapsed
+            self.search_nodes = searcher.nodes
+
+    def solve(self, moves_file=None, search=False, search_timeout=None, stats=None, max_subset=MAX_SUBSET,
+            finned_fish=False, cache=None, scheduler=None, timeout=None, max_iterations=None, cancel=None):
+        """Solve the puzzle with logic. If search is set, complete the puzzle with a search once logic stalls.
+
+        Naked and hidden subsets are looked for up to max_subset squares or digits. If finned_fish is set, finned and
+        sashimi fishes are looked for after the basic ones. If a Scheduler is provided, it chooses the techniques
+        instead, and max_subset and finned_fish are ignored. If a SolutionCache is provided, the solution is looked up
+        in it first, and stored in it once found.
+
+        If a SolverStats instance is provided, per-technique statistics are recorded into it and are available as
+        the stats attribute of the puzzle.
+
+        Solving stops after timeout seconds or max_iterations iterations, or once the cancel function returns True,
+        leaving the grid as far as it got. The search fallback is given the time left. Returns a SolveResult.
+        """
+        start = time.perf_counter()
+        if stats is not None:
+            self.stats = stats
+        if not self.is_valid():
+            logging.error("Puzzle is invalid!")
+            logging.error(self.contradiction)
+            return SolveResult(SOLVE_INVALID, self.to_string(), self.stats, 0, time.perf_counter() - start)
+
+        cached = None
+        if cache is not None:
+            puzzle = self.to_string()
+            cached, canonical, transform = cache.lookup(puzzle)
+            self.cache_hit = cached is not None
+            if cached is not None:
+                logging.info("Found the solution in the cache")
+                self.fill(cached)
+
+        if scheduler is None:
+            scheduler = Scheduler(max_subset, finned_fish)
+        current_moves = len(self.move_stack)
+        iterations = 0
+        interrupted = None
+        self.deadline = start + timeout if timeout is not None else None
+        self.cancel = cancel
+        try:
+            while not self.is_solved():
+                if max_iterations is not None and iterations >= max_iterations:
+                    raise Interrupted(SOLVE_TIMED_OUT, "Ran out of iterations")
+                iterations += 1
+
+                logging.info("Iteration %d", iterations)
+                # Perform moves
+
+                # Update notation
+                self.update_notation(scheduler=scheduler)
+
+                # TODO: add interactive mode
+                # if current_moves != len(self.move_stack):
+                #    print(self)
+
+                # Solve the singles created by the techniques
+                solved_this_round = self.run_technique("Singles", self.propagate)
+
+                if solved_this_round:
+                    logging.info("Solved singles")
+
+                # TODO: add interactive mode
+                #if DEBUG and solved_this_round:
+                #    print("Solved singles:")
+                #    print(self)
+
+                if current_moves == len(self.move_stack):
+                    # If I did not perform any move this turn I am stuck
+                    if not search:
+                        logging.error("Cannot make further progress!")
+                        break
+                    # Take over from the current state with a search
+                    logging.info("Cannot make further progress, falling back to search")
+                    if self.deadline is not None:
+                        left = max(0.0, self.deadline - time.perf_counter())
+                        search_timeout = left if search_timeout is None else min(search_timeout, left)
+                    if not self.run_technique("Search", self.search, search_timeout):
+                        # A search cut short by the deadline ran out of time
+                        self.check_deadline()
+                        break
+                current_moves = len(self.move_stack)
+        except Contradiction as e:
+            # The grid is left as it was when the contradiction was found
+            logging.error("Puzzle is invalid!")
+            logging.error(e)
+        except Interrupted as e:
+            logging.error("%s after %d iterations", e, iterations)
+            interrupted = e.status
+        finally:
+            self.deadline = None
+            self.cancel = None
+        logging.info("Performed %d moves in %d iterations", len(self.move_stack), iterations)
+        if moves_file:
+            # Write the move stack to file
+            self.write_moves(moves_file)
+        solved = self.is_valid() and self.is_solved()
+        if cache is not None and cached is None and solved:
+            cache.store(puzzle, canonical, transform, self.to_string())
+        status = SOLVE_INVALID if not self.is_valid() else interrupted or (SOLVE_SOLVED if solved else SOLVE_STALLED)
+        return SolveResult(status, self.to_string(), self.stats, iterations, time.perf_counter() - start)
+
+# Result of a bulk puzzle: solutions is the number of solutions, up to 2, when checking uniqueness, cache is the
+# (hit, evictions) pair of the lookup when using a SolutionCache, status is the SolveResult status, if solved
+# with Puzzle.solve(), and stored is set for the results found in a ResultStore instead of being solved
+BulkResult = collections.namedtuple("BulkResult", ("solved", "solution", "grid", "search_time", "stats", "solutions",
+    "cache", "status", "stored"), defaults=(None, None, False))
+
+# SolutionCache of the bulk worker process
+_bulk_cache = None
+# Scheduler options and Scheduler of the bulk worker process
+_bulk_scheduler = (None, None)
+
+def describe_solutions(count):
+    """Describe a number of solutions returned by Puzzle.count_solutions(limit=2)."""
+    if count is None:
+        return "an unknown number of solutions (timed out)"
+    return ("no solution", "a unique solution", "multiple solutions")[count]
+
+def solve_bulk_chunk(puzzles, search=False, search_timeout=None, stats=False, max_subset=MAX_SUBSET,
+        finned_fish=False, cache_size=0, batch=False, policy="fixed", disabled=(), budgets=None, timeout=None,
+        max_iterations=None):
+    """Solve a chunk of puzzle strings.
+
+    Returns a list of BulkResult tuples, where solution is the string of the final values, grid is the printed grid
+    of the puzzles which could not be solved and stats is the dictionary of the SolverStats of the puzzle if stats is
+    set. Only strings, numbers and dictionaries of them go in and out, so chunks can be solved in worker processes.
+
+    If cache_size is set, solutions are cached across chunks in a SolutionCache of that size in each process.
+
+    The techniques are chosen by a Scheduler with the scheduling policy, the disabled techniques and the time budgets,
+    which is kept across chunks in each process.
+
+    If batch is set, the whole chunk is first propagated by the BatchSolver, and only the puzzles it could not solve
+    are solved one by one. Statistics are not collected for the puzzles solved by the BatchSolver.
+
+    Each puzzle is given up to timeout seconds and max_iterations iterations, and is reported as timed out beyond.
+    """
+    global _bulk_cache, _bulk_scheduler
+    if cache_size and (_bulk_cache is None or _bulk_cache.size != cache_size):
+        _bulk_cache = SolutionCache(cache_size)
+    cache = _bulk_cache if cache_size else None
+    options = (max_subset, finned_fish, policy, frozenset(disabled), tuple(sorted((budgets or {}).items())))
+    if _bulk_scheduler[0] != options:
+        _bulk_scheduler = (options, Scheduler(max_subset, finned_fish, policy, disabled, budgets))
+    scheduler = _bulk_scheduler[1]
+    results = []
+    for values, solution in zip(puzzles, BatchSolver().solve(puzzles) if batch else [None] * len(puzzles)):
+        if solution is not None:
+            results.append(BulkResult(True, solution, None, None, None, None, None, SOLVE_SOLVED))
+            continue
+        p = Puzzle(values)
+        evictions = cache.evictions if cache else 0
+        result = p.solve(search=search, search_timeout=search_timeout, stats=SolverStats() if stats else None,
+            cache=cache, scheduler=scheduler, timeout=timeout, max_iterations=max_iterations)
+        results.append(BulkResult(bool(result), result.grid, None if result else str(p), p.search_time,
+            p.stats.to_dict() if stats else None, None,
+            (p.cache_hit, cache.evictions - evictions) if cache else None, result.status))
+    return results
+
+class ResultStore:
+    """Results of bulk runs kept in a SQLite database, keyed by normalized puzzle string and solver options.
+
+    Results are only visible to runs with the same options string, as the options decide whether a puzzle can be
+    solved. Writes are committed every STORE_BATCH_SIZE results and when the store is closed.
+    """
+    def __init__(self, path, options=""):
+        self.options = options
+        self.hits = 0
+        self.misses = 0
+        self._pending = 0
+        self._db = sqlite3.connect(path)
+        self._db.execute("CREATE TABLE IF NOT EXISTS results (puzzle TEXT, options TEXT, solved INTEGER, "
+            "solution TEXT, grid TEXT, search_time REAL, solutions INTEGER, stats TEXT, status TEXT, "
+            "PRIMARY KEY (puzzle, options))")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def lookup(self, puzzles):
+        """Return a dictionary of the stored BulkResult of each of a list of puzzle strings, if any."""
+        found = {}
+        unique = list(set(puzzles))
+        # Stay below the SQLite limit on the number of query parameters
+        for i in range(0, len(unique), 500):
+            batch = unique[i:i + 500]
+            rows = self._db.execute("SELECT puzzle, solved, solution, grid, search_time, solutions, stats, status "
+                "FROM results WHERE options = ? AND puzzle IN ({})".format(",".join("?" * len(batch))),
+                [self.options] + batch)
+            for values, solved, solution, grid, search_time, solutions, stats, status in rows:
+                found[values] = BulkResult(bool(solved), solution, grid, search_time,
+                    json.loads(stats) if stats is not None else None, solutions, None, status, True)
+        self.hits += sum([1 for values in puzzles if values in found])
+        self.misses += sum([1 for values in puzzles if values not in found])
+        return found
+
+    def add(self, results):
+        """Store a dictionary of the BulkResult of each puzzle string."""
+        self._db.executemany("INSERT OR REPLACE INTO results (puzzle, options, solved, solution, grid, search_time, "
+            "solutions, stats, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(values, self.options, int(r.solved), r.solution, r.grid, r.search_time, r.solutions,
+                json.dumps(r.stats) if r.stats is not None else None, r.status) for values, r in results.items()])
+        self._pending += len(results)
+        if self._pending >= STORE_BATCH_SIZE:
+            self._db.commit()
+            self._pending = 0
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
 
-        ## N-fishes
-        # Find X-Wings
-        if self.find_x_wings():
-            return
+    def __str__(self):
+        return "Store: {} hits, {} misses".format(self.hits, self.misses)
+
+def check_bulk_chunk(puzzles, search_timeout=None):
+    """Check the uniqueness of the solution of a chunk of puzzle strings.
+
+    Returns a list of BulkResult tuples, where solved is set for puzzles with a unique solution and solution is
+    that solution, or the puzzle itself otherwise.
+    """
+    results = []
+    for values in puzzles:
+        searcher = Search(search_timeout)
+        try:
+            found = searcher.solutions(Search.grid_masks(Puzzle(values)), 2)
+            count = len(found)
+        except SearchTimeout:
+            logging.error("Uniqueness check timed out after {:.3f}s".format(searcher.elapsed))
+            count = None
+        results.append(BulkResult(count == 1, Search.to_string(found[0]) if count == 1 else values, None,
+            searcher.elapsed, None, count))
+    return results
+
+# Difficulty levels of generated puzzles, from the easiest: the hardest technique a puzzle needs is singles,
+# intersection removal, naked/hidden subsets or fishes, or logic alone cannot solve it and it needs a search
+DIFFICULTIES = ("easy", "intersection", "subsets", "fish", "search")
+# Difficulty level of each technique
+TECHNIQUE_DIFFICULTY = {"Singles": 0, **{t.name: 1 if t.name in ("Naked lines", "Hidden lines") else
+    3 if t.units is None else 2 for t in TECHNIQUES}}
+
+class Generator:
+    """Generate random puzzles with a unique solution at a difficulty level.
+
+    Each attempt starts from a random full grid and removes clues in pairs symmetric about the center, keeping a
+    removal only if the puzzle can still be solved by the techniques of the difficulty level (or, for the search
+    level, still has a unique solution). Solving with logic proves uniqueness, and a puzzle whose removal is kept
+    always had a unique solution, so only the removed squares need to be checked by the search. The attempt succeeds
+    if the hardest technique needed by the final puzzle is of the difficulty level.
+    """
+
+    def __init__(self, difficulty="easy", max_subset=MAX_SUBSET, finned_fish=False, seed=None):
+        if difficulty not in DIFFICULTIES:
+            raise ValueError("Unknown difficulty {}".format(difficulty))
+        self.level = DIFFICULTIES.index(difficulty)
+        self.random = random.Random(seed)
+        self.scheduler = Scheduler(max_subset, finned_fish,
+            disabled=[name for name, level in TECHNIQUE_DIFFICULTY.items() if level > self.level])
+        # Number of full grids tried
+        self.attempts = 0
+
+    def solution(self):
+        """Return a random full grid."""
+        # The diagonal boxes do not share units: fill them at random and complete the grid with a search
+        masks = [ALL_CANDIDATES] * 81
+        for b in (0, 4, 8):
+            for i, d in zip(BOX_INDICES[b], self.random.sample(Square.digits, 9)):
+                masks[i] = 1 << (d - 1)
+        solution = Search.to_string(Search().solve(masks))
+        # Shuffle the completed grid with a random symmetry
+        rows = [b * 3 + r for b in self.random.sample(range(3), 3) for r in self.random.sample(range(3), 3)]
+        columns = [s * 3 + c for s in self.random.sample(range(3), 3) for c in self.random.sample(range(3), 3)]
+        labels = (0,) + tuple(self.random.sample(Square.digits, 9))
+        return apply_transform(solution, (self.random.random() < 0.5, rows, columns, labels))
+
+    def grade(self, values):
+        """Return the difficulty level of a puzzle string, or None if the techniques of the difficulty level of the
+        generator cannot solve it."""
+        p = Puzzle(values)
+        p.stats = SolverStats()
+        # Stalling is expected here: apply the techniques like solve() does, without reporting it
+        moves = None
+        while not p.is_solved():
+            if moves == len(p.move_stack):
+                return None
+            moves = len(p.move_stack)
+            p.update_notation(scheduler=self.scheduler)
+        return max([TECHNIQUE_DIFFICULTY[name] for name, (_, hits, _, _) in p.stats.techniques.items() if hits])
 
-        # Find Swordfishes
-        if self.find_swordfishes():
-            return
+    @staticmethod
+    def unique(values, solution, removed):
+        """Return True if a puzzle string has no solution other than solution, knowing that it does not have any once
+        the squares in removed are given their values."""
+        masks = [1 << (int(v) - 1) if v != "0" else ALL_CANDIDATES for v in values]
+        # Any other solution differs from solution in one of the removed squares
+        for i in removed:
+            other = masks[:]
+            other[i] &= ~(1 << (int(solution[i]) - 1))
+            if Search().solve(other) is not None:
+                return False
+        return True
 
-        # Find Jellyfishes
-        if self.find_jellyfishes():
-            return
+    def generate(self):
+        """Return a (puzzle string, solution string) pair for a new puzzle of the difficulty level."""
+        search = len(DIFFICULTIES) - 1
+        while True:
+            self.attempts += 1
+            solution = self.solution()
+            digits = list(solution)
+            level = 0
+            pairs = [(i, 80 - i) if i != 40 else (40,) for i in range(41)]
+            self.random.shuffle(pairs)
+            for removed in pairs:
+                for i in removed:
+                    digits[i] = "0"
+                values = "".join(digits)
+                graded = self.grade(values)
+                if graded is None and self.level == search and self.unique(values, solution, removed):
+                    graded = search
+                if graded is None:
+                    for i in removed:
+                        digits[i] = solution[i]
+                else:
+                    level = graded
+            if level == self.level:
+                return "".join(digits), solution
+
+def generate_chunk(count, difficulty="easy", max_subset=MAX_SUBSET, finned_fish=False, seed=None):
+    """Generate a chunk of puzzles of a difficulty level.
+
+    Returns a list of the (puzzle string, solution string) pairs and the number of full grids tried. Only strings and
+    numbers go in and out, so chunks can be generated in worker processes.
+    """
+    generator = Generator(difficulty, max_subset, finned_fish, seed)
+    return [generator.generate() for _ in range(count)], generator.attempts
+
+def generate_bulk(count, generate_chunk, jobs=1, log_level=None, seed=None, chunk_size=GENERATE_CHUNK_SIZE):
+    """Generate count puzzles in chunks, yielding the result of generate_chunk() for each chunk in order.
+
+    If seed is set, each chunk is generated with a seed derived from it, so the puzzles do not depend on jobs.
+    """
+    tasks = [(generate_chunk, min(chunk_size, count - start), None if seed is None else "{}:{}".format(seed, start))
+        for start in range(0, count, chunk_size)]
+    if jobs == 1:
+        for task in tasks:
+            yield _generate_task(task)
+        return
+    with multiprocessing.Pool(jobs or os.cpu_count(), _init_worker, (log_level,)) as pool:
+        yield from pool.imap(_generate_task, tasks)
+
+def _generate_task(task):
+    """Generate a chunk of puzzles in a worker process."""
+    generate_chunk, count, seed = task
+    return generate_chunk(count, seed=seed)
+
+def read_bulk_puzzles(f_in, first_line=1):
+    """Yield (line number, puzzle string) pairs for the puzzles in a bulk file, logging invalid lines."""
+    for i, l in enumerate(f_in, start=first_line):
+        l = l.strip()
+        # Ignore comments
+        if l.startswith(("#", "//", "%", "\"")):
+            continue
+        try:
+            yield i, Puzzle.normalize(l)
+        except ValueError as e:
+            logging.error("Could not process puzzle at line {}".format(i))
+            logging.error(e)
+
+class PuzzleFile:
+    """A memory-mapped bulk file of fixed-width records: one 81 character puzzle per line.
+
+    Record boundaries are computed from the record size rather than searched for, and records are validated and
+    decoded PUZZLE_FILE_BLOCK at a time with bytes operations on the mapped buffer. Raises ValueError if the file
+    does not have fixed-width records, i.e. if any line separator is not at the end of a record.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f_in:
+            if not os.fstat(f_in.fileno()).st_size:
+                raise ValueError("Empty file {}".format(path))
+            self._map = mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(self._map, "madvise"):
+            self._map.madvise(mmap.MADV_SEQUENTIAL)
+        # Records end with LF or CR LF, except possibly the last one
+        first = self._map.find(b"\n")
+        self._newline = b"\r\n" if first == 82 and self._map[81:82] == b"\r" else b"\n"
+        self.record_size = 81 + len(self._newline)
+        size = len(self._map)
+        self.count = -(-size // self.record_size)
+        # Lines of other lengths could add up to a multiple of the record size: check all the separators once
+        if first not in (-1, self.record_size - 1) or size % self.record_size not in (0, 81) or not all(
+                [self.__aligned(self._map[k * self.record_size:(k + PUZZLE_FILE_BLOCK) * self.record_size])
+                for k in range(0, self.count, PUZZLE_FILE_BLOCK)]):
+            self.close()
+            raise ValueError("{} does not have fixed-width records".format(path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self._map.close()
+
+    def __aligned(self, block):
+        # All the line separators of a block of records are at the end of the records
+        rs = self.record_size
+        for sep in b"\r\n":
+            j = self._newline.find(sep)
+            found = block[81 + j::rs] if j >= 0 else b""
+            if found != bytes([sep]) * len(found) or block.count(sep) != len(found):
+                return False
+        return True
 
-        # Perform more logic
+    def __valid(self, block):
+        # All separators are in place, and everything else is a square
+        return self.__aligned(block) and not block.translate(None, PUZZLE_FILE_BYTES)
+
+    def records(self, start=0, stop=None):
+        """Yield (line number, puzzle string) pairs for the records from index start to stop.
+
+        Blocks which are not made of valid puzzles, e.g. because of comments, are read line by line like in
+        read_bulk_puzzles().
+        """
+        rs = self.record_size
+        stop = self.count if stop is None else min(stop, self.count)
+        for first in range(start, stop, PUZZLE_FILE_BLOCK):
+            last = min(first + PUZZLE_FILE_BLOCK, stop)
+            block = self._map[first * rs:last * rs]
+            if self.__valid(block):
+                text = block.decode("ascii").replace(".", "0")
+                for k in range(last - first):
+                    yield first + k + 1, text[k * rs:k * rs + 81]
+            else:
+                yield from read_bulk_puzzles(block.decode("ascii", errors="replace").splitlines(), first + 1)
+
+def pack_puzzle(values):
+    """Pack a normalized 81 digit string into 41 bytes, two squares per byte, high nibble first."""
+    return bytes.fromhex(values + "0")
+
+def unpack_puzzle(data):
+    """Unpack the 81 digit string packed by pack_puzzle()."""
+    return data.hex()[:81]
+
+class PackedPuzzles:
+    """A memory-mapped packed puzzle file.
+
+    The file starts with a PACKED_HEADER (magic, version, flags, record size and number of records) followed by
+    fixed-size records, so record i is found at PACKED_HEADER.size + i * record_size. A record holds the packed
+    puzzle and, if the file has the PACKED_SOLUTIONS flag, the packed solution (or the final grid of an unsolved
+    puzzle) and a byte of PACKED_SOLVED/PACKED_SEARCHED status flags. Raises ValueError if the file is not a
+    packed puzzle file.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f_in:
+            header = f_in.read(PACKED_HEADER.size)
+            if len(header) < PACKED_HEADER.size or not header.startswith(PACKED_MAGIC):
+                raise ValueError("{} is not a packed puzzle file".format(path))
+            _, version, self.flags, self.record_size, self.count = PACKED_HEADER.unpack(header)
+            if version != PACKED_VERSION:
+                raise ValueError("Unsupported packed puzzle file version {}".format(version))
+            if self.record_size != (83 if self.flags & PACKED_SOLUTIONS else 41):
+                raise ValueError("Invalid record size {}".format(self.record_size))
+            size = os.fstat(f_in.fileno()).st_size
+            if size != PACKED_HEADER.size + self.count * self.record_size:
+                raise ValueError("{} is truncated (expected {} records)".format(path, self.count))
+            self._map = mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ) if self.count else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+
+    def __record(self, i):
+        if not 0 <= i < self.count:
+            raise IndexError("Record {} out of range".format(i))
+        start = PACKED_HEADER.size + i * self.record_size
+        return self._map[start:start + self.record_size]
+
+    def __getitem__(self, i):
+        """Return the puzzle string of record i."""
+        return Puzzle.normalize(unpack_puzzle(self.__record(i)[:41]))
+
+    def solution(self, i):
+        """Return the (solution string, status flags) pair of record i, or (None, 0) if the file has no solutions."""
+        if not self.flags & PACKED_SOLUTIONS:
+            return None, 0
+        record = self.__record(i)
+        return unpack_puzzle(record[41:82]), record[82]
+
+    def records(self, start=0, stop=None):
+        """Yield (record number, puzzle string) pairs for the records from index start to stop, numbered from 1
+        like the lines of a bulk file, logging invalid records."""
+        stop = self.count if stop is None else min(stop, self.count)
+        # Two hexadecimal digits per byte
+        rs = self.record_size * 2
+        for first in range(start, stop, PUZZLE_FILE_BLOCK):
+            last = min(first + PUZZLE_FILE_BLOCK, stop)
+            text = self._map[PACKED_HEADER.size + first * self.record_size:
+                PACKED_HEADER.size + last * self.record_size].hex()
+            valid = text.isdigit()
+            for k in range(last - first):
+                values = text[k * rs:k * rs + 81]
+                if valid or values.isdigit():
+                    yield first + k + 1, values
+                else:
+                    logging.error("Could not process puzzle at record {}".format(first + k + 1))
+                    logging.error("Invalid puzzle value {}".format(values.strip("0123456789")[0]))
+
+class PackedWriter:
+    """Write puzzles, with their solutions and status flags if solutions is set, to a seekable binary file in the
+    format read by PackedPuzzles. The number of records is written to the header on close()."""
+
+    def __init__(self, f_out, solutions=False):
+        self._f_out = f_out
+        self.flags = PACKED_SOLUTIONS if solutions else 0
+        self.record_size = 83 if solutions else 41
+        self.count = 0
+        f_out.write(self.__header())
+
+    def __header(self):
+        return PACKED_HEADER.pack(PACKED_MAGIC, PACKED_VERSION, self.flags, self.record_size, self.count)
+
+    def write(self, values, solution=None, status=0):
+        record = pack_puzzle(values)
+        if self.flags & PACKED_SOLUTIONS:
+            record += pack_puzzle(solution or "0" * 81) + bytes([status])
+        self._f_out.write(record)
+        self.count += 1
+
+    def close(self):
+        self._f_out.seek(0)
+        self._f_out.write(self.__header())
+        self._f_out.seek(0, os.SEEK_END)
+
+def is_packed_file(path):
+    """Return True if path is a packed puzzle file."""
+    with open(path, "rb") as f_in:
+        return f_in.read(len(PACKED_MAGIC)) == PACKED_MAGIC
+
+def read_puzzle_file(path):
+    """Return an iterator of (line number, puzzle string) pairs for the puzzles in a bulk file, memory-mapping it if
+    it is a packed puzzle file or has fixed-width records. The file is opened right away, and closed once the
+    iterator is exhausted."""
+    if is_packed_file(path):
+        f_in = PackedPuzzles(path)
+    else:
+        try:
+            f_in = PuzzleFile(path)
+        except ValueError:
+            f_in = open(path, "r")
+    def read():
+        with f_in:
+            yield from (f_in.records() if isinstance(f_in, (PackedPuzzles, PuzzleFile)) else read_bulk_puzzles(f_in))
+    return read()
+
+def solve_bulk(puzzles, solve_chunk, jobs=1, log_level=None, store=None, chunk_size=BULK_CHUNK_SIZE):
+    """Solve (line number, puzzle string) pairs in chunks, yielding (line number, puzzle string, result) in input order.
+
+    Chunks are read from puzzles only as results are consumed, with at most two chunks per worker process in
+    flight, so memory use does not grow with the number of puzzles.
+
+    If store is set, puzzles found in the ResultStore and repeated puzzles of a chunk are not solved again, and new
+    results are added to the store. Duplicates of puzzles in chunks still being solved by worker processes are
+    solved again.
+    """
+    def start(chunk):
+        # Return the known results of a chunk and the distinct puzzles left to solve
+        known = store.lookup([v for _, v in chunk]) if store else {}
+        return known, list(dict.fromkeys([v for _, v in chunk if v not in known]))
+
+    def finish(chunk, known, todo, results):
+        solved = dict(zip(todo, results))
+        if store:
+            # Running out of time depends on the load of the machine: try again next time
+            store.add({values: r for values, r in solved.items() if r.status != SOLVE_TIMED_OUT})
+        known.update(solved)
+        for line, values in chunk:
+            yield line, values, known[values]
+
+    chunks = iter(lambda: list(itertools.islice(puzzles, chunk_size)), [])
+    if jobs == 1:
+        for chunk in chunks:
+            known, todo = start(chunk)
+            yield from finish(chunk, known, todo, solve_chunk(todo) if todo else [])
         return
+    workers = jobs or os.cpu_count()
+    with multiprocessing.Pool(workers, _init_worker, (log_level,)) as pool:
+        pending = collections.deque()
+        for chunk in itertools.chain(chunks, [None]):
+            if chunk is not None:
+                known, todo = start(chunk)
+                pending.append((chunk, known, todo, pool.apply_async(solve_chunk, (todo,)) if todo else None))
+            # Wait for the oldest chunk once the window is full, or drain the window at the end of the input
+            while pending and (chunk is None or len(pending) >= 2 * workers):
+                done, known, todo, results = pending.popleft()
+                yield from finish(done, known, todo, results.get() if results else [])
+
+def bulk_writer(f_out, fmt, check_unique=False):
+    """Return a function writing the BulkResult of a puzzle to f_out in the given format. For the packed format,
+    f_out is a PackedWriter with solutions."""
+    if fmt == "packed":
+        def write(index, line, values, result):
+            f_out.write(values, result.solution, (PACKED_SOLVED if result.solved else 0) |
+                (PACKED_SEARCHED if result.search_time is not None else 0))
+    elif fmt == "jsonl":
+        def write(index, line, values, result):
+            record = {"index": index, "line": line, "puzzle": values, "solution": result.solution,
+                "solved": result.solved}
+            if result.status is not None:
+                record["status"] = result.status
+            if check_unique:
+                record["solutions"] = result.solutions
+            f_out.write(json.dumps(record) + "\n")
+    elif fmt == "csv":
+        writer = csv.writer(f_out)
+        writer.writerow(["index", "line", "puzzle", "solution", "solved"] + (["solutions"] if check_unique else []))
+        def write(index, line, values, result):
+            writer.writerow([index, line, values, result.solution, int(result.solved)] +
+                ([result.solutions] if check_unique else []))
+    elif check_unique:
+        def write(index, line, values, result):
+            if not result.solved:
+                print("Puzzle {} has {}".format(index, describe_solutions(result.solutions)), file=f_out)
+    else:
+        def write(index, line, values, result):
+            if result.status == SOLVE_TIMED_OUT:
+                print("Timed out on Puzzle {}:".format(index), file=f_out)
+                print(result.grid, file=f_out)
+            elif not result.solved:
+                print("Could not solve Puzzle {}:".format(index), file=f_out)
+                print(result.grid, file=f_out)
+    return write
+
+class SolverServer:
+    """Solve puzzles sent over a Unix socket or a TCP connection with a pool of long-lived worker processes.
+
+    Each line of a request stream is a puzzle string or a JSON object with a "puzzle" and an optional "id", and
+    gets a JSON line in response, in the order of the requests. Requests of all connections are queued and sent to
+    the workers in chunks of up to BULK_CHUNK_SIZE puzzles, each chunk taking whatever is queued when a worker
+    becomes free. Connections stop being read while the queue or their own responses are full.
+    """
+
+    def __init__(self, solve_chunk, jobs=1, log_level=None):
+        self.solve_chunk = solve_chunk
+        self.workers = jobs or os.cpu_count()
+        self.log_level = log_level
+        self._queue = None
+        self._stopping = None
+
+    async def serve(self, address):
+        """Serve requests on address, a Unix socket path or HOST:PORT, until SIGINT or SIGTERM.
+
+        On shutdown, the server stops accepting connections and reading requests, and answers the requests already
+        read before returning.
+        """
+        loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(SERVE_QUEUE_SIZE)
+        self._stopping = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self._stopping.set)
+        handlers = set()
+        def connect(reader, writer):
+            task = asyncio.ensure_future(self._handle(reader, writer))
+            handlers.add(task)
+            task.add_done_callback(handlers.discard)
+
+        host, _, port = address.rpartition(":")
+        with concurrent.futures.ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                initargs=(self.log_level,)) as pool:
+            # Start the workers before the first request
+            await asyncio.gather(*[loop.run_in_executor(pool, self.solve_chunk, []) for _ in range(self.workers)])
+            if port.isdigit():
+                server = await asyncio.start_server(connect, host or "localhost", int(port))
+            else:
+                server = await asyncio.start_unix_server(connect, address)
+            logging.info("Listening on {}".format(address))
+            batcher = asyncio.ensure_future(self._batch(loop, pool))
+            try:
+                await self._stopping.wait()
+                logging.info("Shutting down")
+                server.close()
+                await server.wait_closed()
+                if handlers:
+                    await asyncio.wait(set(handlers))
+            finally:
+                batcher.cancel()
+                if not port.isdigit() and os.path.exists(address):
+                    os.remove(address)
+
+    async def _batch(self, loop, pool):
+        # Send the queued requests to the workers, at most one chunk per worker at a time
+        slots = asyncio.Semaphore(self.workers)
+        while True:
+            batch = [await self._queue.get()]
+            await slots.acquire()
+            while len(batch) < BULK_CHUNK_SIZE and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            task = loop.run_in_executor(pool, self.solve_chunk, [values for values, _ in batch])
+            task.add_done_callback(functools.partial(self._finish, batch, slots))
 
-    def solve(self, moves_file=None):
-        if not self.is_valid():
-            logging.error("Puzzle is invalid!")
-            return
+    @staticmethod
+    def _finish(batch, slots, task):
+        slots.release()
+        for k, (_, future) in enumerate(batch):
+            if future.cancelled():
+                continue
+            if task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result()[k])
+
+    async def _handle(self, reader, writer):
+        # Read requests until the end of the stream or shutdown, while another task writes the responses in order
+        loop = asyncio.get_running_loop()
+        responses = asyncio.Queue(SERVE_QUEUE_SIZE)
+        sender = asyncio.ensure_future(self._send(responses, writer))
+        stopping = asyncio.ensure_future(self._stopping.wait())
+        try:
+            while True:
+                read = asyncio.ensure_future(reader.readline())
+                await asyncio.wait((read, stopping), return_when=asyncio.FIRST_COMPLETED)
+                if not read.done():
+                    read.cancel()
+                    break
+                line = read.result().decode(errors="replace").strip()
+                if not line:
+                    if read.result():
+                        continue
+                    break
+                request_id = None
+                future = loop.create_future()
+                try:
+                    values = line
+                    if line.startswith("{"):
+                        request = json.loads(line)
+                        request_id = request.get("id")
+                        values = request["puzzle"]
+                    values = Puzzle.normalize(values)
+                except (ValueError, KeyError, AttributeError, TypeError) as e:
+                    values = None
+                    future.set_exception(ValueError("Invalid request: {}".format(e)))
+                await responses.put((request_id, values, time.perf_counter(), future))
+                if values is not None:
+                    await self._queue.put((values, future))
+        except (ConnectionError, ValueError) as e:
+            logging.warning("Connection closed: {}".format(e))
+        finally:
+            stopping.cancel()
+            await responses.put(None)
+            await sender
+            writer.close()
 
-        if moves_file:
-            # Truncate move stack file
-            with open(moves_file, "w"):
+    @staticmethod
+    async def _send(responses, writer):
+        while True:
+            item = await responses.get()
+            if item is None:
+                return
+            request_id, values, start, future = item
+            response = {} if request_id is None else {"id": request_id}
+            try:
+                result = await future
+                response.update({"puzzle": values, "solution": result.solution, "solved": result.solved})
+                if result.solutions is not None:
+                    response["solutions"] = result.solutions
+                if result.stats is not None:
+                    response["stats"] = result.stats
+                if result.search_time is not None:
+                    response["search_time"] = result.search_time
+                if result.status is not None:
+                    response["status"] = result.status
+            except Exception as e:
+                response["error"] = str(e)
+            response["elapsed_ms"] = (time.perf_counter() - start) * 1000
+            try:
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+            except ConnectionError:
+                # Keep answering the requests of the connection, so that its reader does not block
                 pass
-        current_moves = len(self.move_stack)
-        iterations = 0
-        while(self.is_solved() == False):
-            iterations += 1
 
-            logging.info("Iteration {}".format(iterations))
-            # Perform moves
-
-            # Update notation
-            self.update_notation()
-
-            # TODO: add interactive mode
-            # if current_moves != len(self.move_stack):
-            #    print(self)
-
-            solved_this_round = []
-            # Solve singles
-            for s in self.unsolved_squares:
-                if len(s.candidates) == 1:
-                    s.value = s.candidates.pop()
-                    solved_this_round.append(s)
-            # Remove solved squares from unsolved
-            for s in solved_this_round:
-                self.unsolved_squares.remove(s)
-
-            if solved_this_round:
-                logging.info("Solved singles")
-
-            # TODO: add interactive mode
-            #if DEBUG and solved_this_round:
-            #    print("Solved singles:")
-            #    print(self)
-
-            if current_moves == len(self.move_stack):
-                # If I did not perform any move this turn I am stuck
-                logging.error("Cannot make further progress!")
-                break
-            elif moves_file:
-                # Write the move stack to file
-                with open(moves_file, "a") as f_out:
-                    for m in self.move_stack[current_moves:]:
-                        f_out.write("{}\n".format(m))
-            current_moves = len(self.move_stack)
-
-            # If we somehow ended up with an invalid puzzle, abort
-            if not self.is_valid():
-                logging.error("Puzzle is invalid!")
-                break
-        logging.info("Performed {} moves in {} iterations".format(len(self.move_stack), iterations))
-        return self.is_valid() and self.is_solved()
+def _init_worker(level):
+    """Configure logging in a bulk worker process like in the main process."""
+    logging.basicConfig(format='%(levelname)s: %(message)s')
+    if level:
+        logging.getLogger().setLevel(level)
+
+def parse_budget(value):
+    """Parse a TECHNIQUE=SECONDS time budget argument into a (technique, seconds) pair."""
+    name, _, seconds = value.rpartition("=")
+    if name not in TECHNIQUE_NAMES:
+        raise argparse.ArgumentTypeError("Unknown technique \"{}\" (choose from {})".format(name,
+            ", ".join(TECHNIQUE_NAMES)))
+    try:
+        return name, float(seconds)
+    except ValueError:
+        raise argparse.ArgumentTypeError("Invalid number of seconds \"{}\"".format(seconds))
 
 def main():
     parser = argparse.ArgumentParser(description="A simple sudoku solver")
     parser.add_argument('file', metavar='FILE', type=str,
-            help="A Sudoku file in text format. Zeroes are used to represent empty cells.")
+            help="A Sudoku file in text format. Zeroes are used to represent empty cells. In bulk mode, - reads from standard input. In server mode, a Unix socket path or HOST:PORT. In generate mode, the bulk file written, or - for standard output. Packed puzzle files are accepted wherever text files are.")
     parser.add_argument("--dump_moves", nargs="?", dest="moves_file", const="moves.log", type=str,
             help="Write the move stack to file [Default: False]")
+    parser.add_argument("--search", action="store_true",
+            help="Complete puzzles with a search when logic cannot make further progress [Default: False]")
+    parser.add_argument("--search_timeout", type=float, metavar="SECONDS",
+            help="Give up on a search after this many seconds [Default: None]")
+    parser.add_argument("-j", "--jobs", type=int, default=1, metavar="N",
+            help="Solve puzzles in bulk mode with N worker processes, 0 for one per CPU [Default: 1]")
+    parser.add_argument("-o", "--output", type=str, metavar="FILE",
+            help="Write bulk results to FILE instead of standard output [Default: None]")
+    parser.add_argument("--format", choices=("text", "jsonl", "csv", "packed"), default="text",
+            help="Format of bulk results: unsolved grids as text, or one JSON/CSV record with the solution per puzzle, or a packed puzzle file with solutions written to --output [Default: text]")
+    parser.add_argument("--max_subset", type=int, default=MAX_SUBSET, metavar="N",
+            help="Look for naked and hidden subsets of up to N squares [Default: {}]".format(MAX_SUBSET))
+    parser.add_argument("--finned_fish", action="store_true",
+            help="Look for finned and sashimi fishes [Default: False]")
+    parser.add_argument("--schedule", choices=SCHEDULER_POLICIES, default="fixed",
+            help="Order in which techniques are tried: from the simplest, from the cheapest by cost estimate, or from the cheapest by time per successful call measured while solving [Default: fixed]")
+    parser.add_argument("--disable", action="append", choices=TECHNIQUE_NAMES, default=[], metavar="TECHNIQUE",
+            help="Never apply TECHNIQUE, one of: {}. Can be repeated [Default: None]".format(", ".join(TECHNIQUE_NAMES)))
+    parser.add_argument("--budget", action="append", type=parse_budget, default=[], metavar="TECHNIQUE=SECONDS",
+            help="Stop applying TECHNIQUE to a puzzle once it has spent SECONDS on it. Can be repeated [Default: None]")
+    parser.add_argument("--timeout", type=float, metavar="SECONDS",
+            help="Stop solving a puzzle after SECONDS, reporting it as timed out [Default: None]")
+    parser.add_argument("--max_iterations", type=int, metavar="N",
+            help="Stop solving a puzzle after N iterations, reporting it as timed out [Default: None]")
+    parser.add_argument("--check_unique", action="store_true",
+            help="Count the solutions of puzzles instead of solving them, reporting those without a unique solution [Default: False]")
+    parser.add_argument("--cache_size", type=int, default=0, metavar="N",
+            help="Cache up to N solutions in bulk mode, matching repeated puzzles by their string and other puzzles up to symmetry. Only pays off when puzzles repeat: each miss costs a canonical form, about a third of an average solve [Default: 0]")
+    parser.add_argument("--store", type=str, metavar="FILE",
+            help="Keep bulk results in the SQLite database FILE and reuse them in later runs [Default: None]")
+    parser.add_argument("--batch", action="store_true",
+            help="Propagate puzzles in bulk mode {} at a time with NumPy before solving them one by one [Default: False]".format(BATCH_CHUNK_SIZE))
+    parser.add_argument("--stats", action="store_true",
+            help="Print per-technique statistics after solving [Default: False]")
+    parser.add_argument("--difficulty", choices=DIFFICULTIES, default="easy",
+            help="Hardest technique needed by generated puzzles, or search for puzzles logic cannot solve [Default: easy]")
+    parser.add_argument("--seed", type=int, metavar="N",
+            help="Seed of the random puzzle generator [Default: None]")
     g_action = parser.add_mutually_exclusive_group()
     g_action.add_argument("-s", "--solve", action='store_const', dest="action", const="solve", default="solve",
             help="Solve the puzzle and exit [Default: True]")
@@ -847,6 +2516,12 @@ def main():
             help="Solve interactively [Default: False]")
     g_action.add_argument("-b", "--bulk", action='store_const', dest="action", const="bulk",
             help="Solve all puzzles found in the file [Default: False]")
+    g_action.add_argument("--serve", action='store_const', dest="action", const="serve",
+            help="Serve requests on a socket with a pool of -j worker processes [Default: False]")
+    g_action.add_argument("--convert", action='store_const', dest="action", const="convert",
+            help="Convert a bulk file to a packed puzzle file written to --output, or a packed puzzle file to a bulk file [Default: False]")
+    g_action.add_argument("--generate", type=int, metavar="N",
+            help="Generate N puzzles of the --difficulty level with -j worker processes [Default: None]")
     g_logging = parser.add_mutually_exclusive_group()
     g_logging.add_argument("-v", "--verbose", action="store_const", dest="logging", const=logging.INFO,
             help="Show solution steps [Default: False]")
@@ -854,6 +2529,8 @@ def main():
             help="Print debug information [Default: False]")
 
     args = parser.parse_args()
+    if args.generate is not None:
+        args.action = "generate"
 
     # Configure logging if required
     logging.basicConfig(format='%(levelname)s: %(message)s')
@@ -861,43 +2538,163 @@ def main():
         logging.getLogger().setLevel(args.logging)
 
     # Perform user action
-    if args.action == "solve":
+    if args.action == "solve" and args.check_unique:
+        # Initialise puzzle
+        p = Puzzle.from_file(args.file)
+
+        try:
+            count = p.count_solutions(2, args.search_timeout)
+        except SearchTimeout:
+            count = None
+        print("Puzzle has {}".format(describe_solutions(count)))
+    elif args.action == "solve":
         # Initialise puzzle
         p = Puzzle.from_file(args.file)
 
-        p.solve(args.moves_file)
+        p.solve(args.moves_file, search=args.search, search_timeout=args.search_timeout,
+            stats=SolverStats() if args.stats else None, scheduler=Scheduler(args.max_subset, args.finned_fish,
+                args.schedule, args.disable, dict(args.budget)), timeout=args.timeout, max_iterations=args.max_iterations)
         print(p)
+        if args.stats:
+            print(p.stats)
     elif args.action == "print":
         # Initialise puzzle
         p = Puzzle.from_file(args.file)
 
         print(p)
+    elif args.action == "convert":
+        if args.file != "-" and is_packed_file(args.file):
+            with PackedPuzzles(args.file) as puzzles, \
+                    (open(args.output, "w") if args.output else contextlib.nullcontext(sys.stdout)) as f_out:
+                for _, values in puzzles.records():
+                    print(values, file=f_out)
+        elif not args.output:
+            logging.error("Packed puzzle files can only be written to --output")
+        else:
+            puzzles = read_bulk_puzzles(sys.stdin) if args.file == "-" else read_puzzle_file(args.file)
+            with open(args.output, "wb") as f_out:
+                packed = PackedWriter(f_out)
+                for _, values in puzzles:
+                    packed.write(values)
+                packed.close()
     elif args.action == "bulk":
-        puzzles = []
-        # Parse all puzzles from file
-        with open(args.file, "r") as f_in:
-            for i, l in enumerate(f_in.readlines(), start=1):
-                l = l.strip()
-                # Ignore comments
-                if l.startswith(("#", "//", "%", "\"")):
-                    continue
-                try:
-                    p = Puzzle(l)
-                except ValueError as e:
-                    logging.error("Could not process puzzle at line {}".format(i))
-                    logging.error(e)
-                else:
-                    puzzles.append(p)
-        # Solve all found puzzles
+        if args.format == "packed" and not args.output:
+            logging.error("Packed puzzle files can only be written to --output")
+            return
+        if args.batch and numpy is None:
+            logging.warning("NumPy is not available, solving puzzles one by one")
+            args.batch = False
+        if args.check_unique:
+            solve_chunk = functools.partial(check_bulk_chunk, search_timeout=args.search_timeout)
+        else:
+            solve_chunk = functools.partial(solve_bulk_chunk, search=args.search, search_timeout=args.search_timeout,
+                stats=args.stats, max_subset=args.max_subset, finned_fish=args.finned_fish, cache_size=args.cache_size,
+                batch=args.batch, policy=args.schedule, disabled=args.disable, budgets=dict(args.budget),
+                timeout=args.timeout, max_iterations=args.max_iterations)
+        stats = SolverStats()
+        # Totals of the caches of all processes
+        cache = SolutionCache()
         solved = 0
-        for i, p in enumerate(puzzles, start=1):
-            if p.solve():
-                solved += 1
-            else:
-                print("Could not solve Puzzle {}:".format(i))
-                print(p)
-        # Print results
-        print("Solved {}/{}".format(solved, len(puzzles)))
+        total = 0
+        # Results found in the store, whose search times belong to the run which solved them
+        stored = 0
+        stored_solved = 0
+        timed_out = 0
+        searched = 0
+        search_time = 0.0
+        max_search_time = 0.0
+        # Stored results are only reused with the options they were found with
+        options = json.dumps({"check_unique": args.check_unique, "search": args.search,
+            "search_timeout": args.search_timeout, "max_subset": args.max_subset, "finned_fish": args.finned_fish,
+            "stats": args.stats, "schedule": args.schedule, "disable": sorted(args.disable),
+            "budget": sorted(args.budget), "timeout": args.timeout, "max_iterations": args.max_iterations})
+        puzzles = read_bulk_puzzles(sys.stdin) if args.file == "-" else read_puzzle_file(args.file)
+        with (open(args.output, "wb") if args.format == "packed" else open(args.output, "w", newline="")
+                    if args.output else contextlib.nullcontext(sys.stdout)) as f_out, \
+                (ResultStore(args.store, options) if args.store else contextlib.nullcontext()) as store:
+            packed = PackedWriter(f_out, solutions=True) if args.format == "packed" else None
+            write = bulk_writer(packed or f_out, args.format, args.check_unique)
+            # Parse, solve and write the puzzles one chunk at a time
+            for total, (line, values, result) in enumerate(
+                    solve_bulk(puzzles, solve_chunk, args.jobs, args.logging, store,
+                        BATCH_CHUNK_SIZE if args.batch else BULK_CHUNK_SIZE), start=1):
+                if result.solved:
+                    solved += 1
+                if result.stored:
+                    stored += 1
+                    stored_solved += 1 if result.solved else 0
+                if result.status == SOLVE_TIMED_OUT:
+                    timed_out += 1
+                write(total, line, values, result)
+                if result.stats is not None:
+                    stats.merge(result.stats)
+                if result.cache is not None:
+                    cache.hits += 1 if result.cache[0] else 0
+                    cache.misses += 0 if result.cache[0] else 1
+                    cache.evictions += result.cache[1]
+                if result.search_time is not None and not result.stored:
+                    searched += 1
+                    search_time += result.search_time
+                    max_search_time = max(max_search_time, result.search_time)
+            if packed:
+                packed.close()
+        # Print results, keeping them out of the records written to standard output
+        f_report = sys.stdout if args.format == "text" or args.output else sys.stderr
+        print("{} {}/{}".format("Unique" if args.check_unique else "Solved", solved, total), file=f_report)
+        if stored:
+            print("Reused {} stored results ({} {})".format(stored, stored_solved,
+                "unique" if args.check_unique else "solved"), file=f_report)
+        if timed_out:
+            print("Timed out on {} puzzles".format(timed_out), file=f_report)
+        if searched:
+            print("Searched {} puzzles in {:.3f}s (max {:.3f}s)".format(searched, search_time, max_search_time),
+                file=f_report)
+        if args.cache_size:
+            print(cache, file=f_report)
+        if args.store:
+            print(store, file=f_report)
+        if args.stats:
+            print(stats, file=f_report)
+    elif args.action == "serve":
+        if args.check_unique:
+            solve_chunk = functools.partial(check_bulk_chunk, search_timeout=args.search_timeout)
+        else:
+            solve_chunk = functools.partial(solve_bulk_chunk, search=args.search, search_timeout=args.search_timeout,
+                stats=True, max_subset=args.max_subset, finned_fish=args.finned_fish, cache_size=args.cache_size,
+                policy=args.schedule, disabled=args.disable, budgets=dict(args.budget), timeout=args.timeout,
+                max_iterations=args.max_iterations)
+        asyncio.run(SolverServer(solve_chunk, args.jobs, args.logging).serve(args.file))
+    elif args.action == "generate":
+        if args.format not in ("text", "packed"):
+            logging.error("Generated puzzles can only be written as text or packed puzzle files")
+            return
+        if args.format == "packed" and args.file == "-":
+            logging.error("Packed puzzle files can only be written to a file")
+            return
+        generate = functools.partial(generate_chunk, difficulty=args.difficulty, max_subset=args.max_subset,
+            finned_fish=args.finned_fish)
+        total = 0
+        attempts = 0
+        start = time.perf_counter()
+        with (contextlib.nullcontext(sys.stdout) if args.file == "-" else
+                open(args.file, "wb" if args.format == "packed" else "w")) as f_out:
+            packed = PackedWriter(f_out, solutions=True) if args.format == "packed" else None
+            for puzzles, chunk_attempts in generate_bulk(args.generate, generate, args.jobs, args.logging,
+                    args.seed):
+                for values, solution in puzzles:
+                    if packed:
+                        packed.write(values, solution, PACKED_SOLVED)
+                    else:
+                        print(values, file=f_out)
+                total += len(puzzles)
+                attempts += chunk_attempts
+            if packed:
+                packed.close()
+        elapsed = time.perf_counter() - start
+        # Print results, keeping them out of the puzzles written to standard output
+        f_report = sys.stderr if args.file == "-" else sys.stdout
+        print("Generated {} {} puzzles in {:.3f}s ({:.1f} puzzles/sec, {} full grids tried)".format(total,
+            args.difficulty, elapsed, total / elapsed if elapsed else 0.0, attempts), file=f_report)
     elif args.action == "interactive":
         logging.warning("Not supported")
     else:
@@ -0,0 +1,88 @@
+import logging
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import sudo
+
+BENCHMARKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks")
+
+def load(name, count=None):
+    with open(os.path.join(BENCHMARKS_DIR, "{}.txt".format(name)), "r") as f_in:
+        return [values for _, values in sudo.read_bulk_puzzles(f_in)][:count]
+
+def line_order(rng):
+    """Return a random order of the 9 rows (columns) which keeps the bands (stacks) together."""
+    bands = rng.sample(range(3), 3)
+    return [b * 3 + r for b in bands for r in rng.sample(range(3), 3)]
+
+def random_symmetry(rng):
+    """Return a function applying the same random Sudoku symmetry to puzzle and solution strings."""
+    transposed = rng.random() < 0.5
+    rows = line_order(rng)
+    columns = line_order(rng)
+    labels = [0] + rng.sample(range(1, 10), 9)
+    def apply(values):
+        if transposed:
+            values = "".join([values[c * 9 + r] for r in range(9) for c in range(9)])
+        return "".join([str(labels[int(values[r * 9 + c])]) for r in rows for c in columns])
+    return apply
+
+class TestCanonical(unittest.TestCase):
+    """Equivalent puzzles share a canonical form, and the SolutionCache maps solutions between them"""
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.rng = random.Random(0)
+        self.puzzles = load("easy", 20) + load("subsets", 20) + load("fish") + load("unsolvable", 20)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_symmetries(self):
+        for values in self.puzzles:
+            canonical, transform = sudo.canonicalize(values)
+            for k in range(5):
+                transformed = random_symmetry(self.rng)(values)
+                with self.subTest(puzzle=values, transformed=transformed):
+                    self.assertEqual(sudo.canonicalize(transformed)[0], canonical)
+            if canonical is not None:
+                self.assertEqual(sudo.apply_transform(values, transform), canonical)
+                self.assertEqual(sudo.invert_transform(canonical, transform), values)
+
+    def test_canonical_hit(self):
+        for values in self.puzzles:
+            cache = sudo.SolutionCache()
+            p = sudo.Puzzle(values)
+            if not p.solve(search=True, cache=cache) or sudo.canonicalize(values)[0] is None:
+                continue
+            symmetry = random_symmetry(self.rng)
+            transformed = symmetry(values)
+            with self.subTest(puzzle=values, transformed=transformed):
+                solution, canonical, _ = cache.lookup(transformed)
+                self.assertIsNotNone(canonical)
+                self.assertEqual(solution, symmetry(p.to_string()))
+                q = sudo.Puzzle(transformed)
+                self.assertTrue(q.solve(cache=cache))
+                self.assertTrue(q.cache_hit)
+                self.assertTrue(q.is_valid())
+                self.assertEqual(q.to_string(), solution)
+
+    def test_exact_hit(self):
+        cache = sudo.SolutionCache()
+        for values in self.puzzles:
+            with self.subTest(puzzle=values):
+                p = sudo.Puzzle(values)
+                if not p.solve(search=True, cache=cache):
+                    continue
+                self.assertEqual(cache.lookup(values), (p.to_string(), None, None))
+                q = sudo.Puzzle(values)
+                self.assertTrue(q.solve(cache=cache))
+                self.assertTrue(q.cache_hit)
+                self.assertEqual(q.to_string(), p.to_string())
+
+if __name__ == "__main__":
+    unittest.main()
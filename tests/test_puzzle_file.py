@@ -0,0 +1,55 @@
+import io
+import logging
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import sudo
+
+class TestReadPuzzleFile(unittest.TestCase):
+    """read_puzzle_file() must yield the same records as read_bulk_puzzles() for any bulk file"""
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        rng = random.Random(0)
+        self.puzzles = ["".join([rng.choice("0123456789") for _ in range(81)]) for _ in range(9000)]
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def check(self, data):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "puzzles.txt")
+            with open(path, "wb") as f_out:
+                f_out.write(data)
+            expected = list(sudo.read_bulk_puzzles(io.StringIO(data.decode("ascii"), newline=None)))
+            self.assertEqual(list(sudo.read_puzzle_file(path)), expected)
+        return expected
+
+    def test_newlines(self):
+        for newline in (b"\n", b"\r\n"):
+            for final in (True, False):
+                with self.subTest(newline=newline, final=final):
+                    data = newline.join([p.encode() for p in self.puzzles]) + (newline if final else b"")
+                    self.assertEqual(len(self.check(data)), len(self.puzzles))
+
+    def test_aligned_comment(self):
+        lines = [p.encode() for p in self.puzzles]
+        lines.insert(10, b"#" * 81)
+        self.assertEqual(len(self.check(b"\n".join(lines) + b"\n")), len(self.puzzles))
+
+    def test_unaligned_comments(self):
+        # Comment lines whose lengths add up to a multiple of the record size
+        lines = [p.encode() for p in self.puzzles]
+        lines.insert(10, b"#" * 3)
+        lines.insert(8500, b"#" * 77)
+        data = b"\n".join(lines) + b"\n"
+        self.assertEqual(len(data) % 82, 0)
+        self.assertEqual(len(self.check(data)), len(self.puzzles))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import logging
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import sudo
+
+BENCHMARKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks")
+
+def load(name, count=None):
+    with open(os.path.join(BENCHMARKS_DIR, "{}.txt".format(name)), "r") as f_in:
+        return [values for _, values in sudo.read_bulk_puzzles(f_in)][:count]
+
+def snapshot(grid):
+    """Return the state of a grid restored by Grid.rollback()."""
+    return {
+        "values": list(grid.values),
+        "masks": list(grid.masks),
+        "unsolved_squares": [s.index for s in grid.unsolved_squares],
+        "unit_unsolved_squares": [[s.index for s in u.unsolved_squares] for u in grid.units],
+        "placed": [u.placed for u in grid.units],
+        "row_positions": [list(p) for p in grid.row_positions],
+        "column_positions": [list(p) for p in grid.column_positions],
+        "box_positions": [list(p) for p in grid.box_positions],
+    }
+
+def clean_records(grid):
+    """Return the units and digits which the techniques may skip, see Grid.find_in_units()."""
+    return ({(n, key) for n, u in enumerate(grid.units)
+            for key, generation in u.clean.items() if generation == u.generation}
+        | {key for key, generation in grid.digits_clean.items() if generation == grid.digit_generations[key[1]]})
+
+def fresh(grid):
+    """Return a new grid with the values and candidates of grid, on which no technique has been applied."""
+    p = sudo.Puzzle(grid.to_string())
+    for s, mask in zip(p.squares, grid.masks):
+        if s.value is None:
+            s.keep_mask(mask)
+    return p
+
+def deductions(grid):
+    """Apply every technique once to the grid, returning the candidates after each of them."""
+    result = []
+    for t in sudo.TECHNIQUES:
+        try:
+            if t.units is None:
+                t.function(grid, *t.args)
+            else:
+                grid.find_in_units(getattr(grid, t.units), t.function, *t.args)
+        except sudo.Contradiction:
+            result.append((t.name, None))
+            break
+        result.append((t.name, list(grid.masks)))
+    return result
+
+class TestRollback(unittest.TestCase):
+    """A guess followed by solve() is undone by rollback()"""
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_guess_solve_rollback(self):
+        puzzles = load("fish") + load("unsolvable", 30)
+        for values in puzzles:
+            for stalled in (False, True):
+                with self.subTest(puzzle=values, stalled=stalled):
+                    p = sudo.Puzzle(values)
+                    if stalled:
+                        # Start from where logic stops
+                        p.solve()
+                        if p.is_solved():
+                            continue
+                    before = snapshot(p)
+                    records = clean_records(p)
+                    mark = p.checkpoint()
+                    s = p.unsolved_squares[0]
+                    # Try every candidate, the wrong ones ending in a contradiction
+                    for d in s.candidates:
+                        try:
+                            s.value = d
+                            p.solve()
+                        except sudo.Contradiction:
+                            pass
+                        p.rollback(mark)
+                        self.assertEqual(snapshot(p), before)
+                        self.assertLessEqual(clean_records(p), records)
+                        self.assertTrue(p.is_valid())
+                    # The techniques skip nothing which a grid with the same candidates would find
+                    q = fresh(p)
+                    self.assertEqual(q.masks, p.masks)
+                    self.assertEqual(deductions(p), deductions(q))
+
+if __name__ == "__main__":
+    unittest.main()